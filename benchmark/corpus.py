@@ -0,0 +1,134 @@
+import os
+import random
+
+NAMES = ["Jan Novák", "Petr Svoboda", "Marie Dvořáková", "John Smith", "Anna Kowalska", "Hans Müller"]
+CITIES = ["Praha", "Brno", "Ostrava", "Bratislava", "London", "Berlin"]
+WORDS = [
+    "the", "contract", "payment", "meeting", "was", "signed", "in", "with", "account", "transfer",
+    "report", "invoice", "delivery", "about", "project", "company", "department", "agreed", "on", "and",
+]
+
+
+def random_sentence(generator: random.Random) -> str:
+    words = generator.choices(WORDS, k=generator.randint(6, 14))
+    words.insert(generator.randint(0, len(words)), generator.choice(NAMES))
+    words.insert(generator.randint(0, len(words)), generator.choice(CITIES))
+    sentence = " ".join(words)
+    return sentence[0].upper() + sentence[1:] + "."
+
+
+def random_text(generator: random.Random, n_sentences: int) -> str:
+    lines = []
+    for _ in range(n_sentences):
+        lines.append(random_sentence(generator))
+    return "\n".join(lines)
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, text: str):
+    """
+    Write a minimal one-page PDF with the text, non-latin characters are replaced
+    """
+    lines = text.encode("latin-1", errors="replace").decode("latin-1").split("\n")
+    stream = "BT /F1 10 Tf 40 800 Td 12 TL\n"
+    stream += "".join(f"({_pdf_escape(line)}) '\n" for line in lines)
+    stream += "ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref_offset = len(content)
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    content += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    content += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode(
+        "latin-1")
+
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def write_csv(path: str, generator: random.Random, n_rows: int):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("name,city,email,note\n")
+        for _ in range(n_rows):
+            name = generator.choice(NAMES)
+            email = name.lower().replace(" ", ".") + "@example.com"
+            f.write(f"{name},{generator.choice(CITIES)},{email},{random_sentence(generator)}\n")
+
+
+def write_email(path: str, generator: random.Random, text: str):
+    sender, recipient = generator.sample(NAMES, 2)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"From: {sender} <{sender.lower().replace(' ', '.')}@example.com>\n")
+        f.write(f"To: {recipient} <{recipient.lower().replace(' ', '.')}@example.com>\n")
+        f.write(f"Subject: {generator.choice(WORDS).capitalize()} {generator.choice(WORDS)}\n")
+        f.write("Date: Mon, 4 Dec 2023 10:00:00 +0100\n")
+        f.write("MIME-Version: 1.0\n")
+        f.write("Content-Type: text/plain; charset=utf-8\n\n")
+        f.write(text + "\n")
+
+
+def write_image(path: str, text: str):
+    import cv2
+    import numpy as np
+
+    lines = text.encode("ascii", errors="replace").decode("ascii").split("\n")
+    image = np.full((40 * len(lines) + 40, 1400, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(image, line[:70], (20, 40 * (i + 1)), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    cv2.imwrite(path, image)
+
+
+def generate_corpus(directory: str, n_files: int, seed: int = 0, images: bool = True,
+                    duplicate_ratio: float = 0.0) -> list[str]:
+    """
+    Generate a synthetic corpus with PDFs, CSV files, emails and images
+    :param duplicate_ratio: fraction of files which are copies of already generated files
+    :return: paths of generated files
+    """
+    generator = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    kinds = ["pdf", "csv", "eml", "txt"] + (["png"] if images else [])
+    paths = []
+
+    for i in range(n_files):
+        subdir = os.path.join(directory, f"dir{i % 10}")
+        os.makedirs(subdir, exist_ok=True)
+
+        if paths and generator.random() < duplicate_ratio:
+            original = generator.choice(paths)
+            path = os.path.join(subdir, f"copy{i}{os.path.splitext(original)[1]}")
+            with open(original, "rb") as src, open(path, "wb") as dst:
+                dst.write(src.read())
+            paths.append(path)
+            continue
+
+        kind = kinds[i % len(kinds)]
+        path = os.path.join(subdir, f"file{i}.{kind}")
+        if kind == "pdf":
+            write_pdf(path, random_text(generator, generator.randint(5, 60)))
+        elif kind == "csv":
+            write_csv(path, generator, generator.randint(10, 500))
+        elif kind == "eml":
+            write_email(path, generator, random_text(generator, generator.randint(3, 20)))
+        elif kind == "txt":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(random_text(generator, generator.randint(5, 200)))
+        else:
+            write_image(path, random_text(generator, generator.randint(3, 10)))
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,227 @@
+import asyncio
+import email
+import html
+import itertools
+import json
+import os
+import re
+from email import policy
+
+from aiohttp import web
+
+from .corpus import NAMES, CITIES
+
+EXTENSION_TO_MIME = {
+    ".pdf": "application/pdf",
+    ".csv": "text/csv",
+    ".eml": "message/rfc822",
+    ".txt": "text/plain",
+    ".png": "image/png",
+}
+
+
+def _sniff_extension(body: bytes) -> str:
+    if body.startswith(b"%PDF"):
+        return ".pdf"
+    if body.startswith(b"\x89PNG"):
+        return ".png"
+    if body.startswith(b"From:"):
+        return ".eml"
+    return ".txt"
+
+
+def _tika_parse(filename: str, body: bytes) -> tuple[dict, str]:
+    extension = os.path.splitext(filename)[1].lower() or _sniff_extension(body)
+    metadata = {"Content-Type": EXTENSION_TO_MIME.get(extension, "application/octet-stream"), "language": "en"}
+    if extension == ".png":
+        return metadata, ""
+    if extension == ".pdf":
+        # text of the generated PDFs is stored as strings shown by the ' operator
+        lines = re.findall(rb"\((.*)\) '", body)
+        return metadata, "\n".join(line.decode("latin-1") for line in lines)
+    if extension == ".eml":
+        message = email.message_from_bytes(body, policy=policy.default)
+        metadata["Message:From-Email"] = message["From"].addresses[0].addr_spec
+        metadata["Message-To"] = [address.addr_spec for address in message["To"].addresses]
+        metadata["dc:subject"] = str(message["Subject"])
+        return metadata, message.get_body().get_content()
+    return metadata, body.decode("utf-8", errors="ignore")
+
+
+class FakeTika:
+    """
+    Tika server stand-in for /meta, /tika and /rmeta/text with configurable latency
+    """
+
+    def __init__(self, latency: float = 0.0, latency_per_mb: float = 0.0):
+        self.latency = latency
+        self.latency_per_mb = latency_per_mb
+        self.requests = 0
+
+    async def _read(self, request: web.Request) -> tuple[dict, str]:
+        body = await request.read()
+        self.requests += 1
+        await asyncio.sleep(self.latency + self.latency_per_mb * len(body) / 2 ** 20)
+        disposition = request.headers.get("Content-Disposition", "")
+        match = re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)", disposition)
+        return _tika_parse(match.group(1) if match else "", body)
+
+    async def handle_meta(self, request: web.Request) -> web.Response:
+        metadata, _ = await self._read(request)
+        return web.json_response(metadata)
+
+    async def handle_text(self, request: web.Request) -> web.Response:
+        _, text = await self._read(request)
+        return web.Response(text=text, content_type="text/plain")
+
+    async def handle_rmeta(self, request: web.Request) -> web.Response:
+        metadata, text = await self._read(request)
+        return web.json_response([{**metadata, "X-TIKA:content": text}])
+
+    async def handle_status(self, _: web.Request) -> web.Response:
+        return web.Response(text="This is Tika Server (fake). Please PUT")
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=2 ** 32)
+        app.router.add_put("/meta", self.handle_meta)
+        app.router.add_put("/tika", self.handle_text)
+        app.router.add_get("/tika", self.handle_status)
+        app.router.add_put("/rmeta/text", self.handle_rmeta)
+        return app
+
+
+class FakeNameTag:
+    """
+    NameTag stand-in which marks names and cities used by the corpus generator as entities
+    """
+
+    def __init__(self, latency: float = 0.0, latency_per_kb: float = 0.0):
+        self.latency = latency
+        self.latency_per_kb = latency_per_kb
+        self.requests = 0
+        pattern = "|".join(re.escape(value) for value in NAMES + CITIES)
+        self.entity_regex = re.compile(f"({pattern})")
+
+    def _tag(self, text: str) -> str:
+        sentences = []
+        for line in text.split("\n"):
+            tagged = self.entity_regex.sub(
+                lambda match: f'<ne type="{"P" if match.group(1) in NAMES else "gu"}">{match.group(1)}</ne>',
+                html.escape(line, quote=False),
+            )
+            sentences.append(f"<sentence>{tagged}</sentence>")
+        return "\n".join(sentences)
+
+    async def handle_recognize(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        data = form.get("data", "")
+        self.requests += 1
+        await asyncio.sleep(self.latency + self.latency_per_kb * len(data) / 1024)
+        return web.json_response({"model": request.query.get("model"), "result": self._tag(data)})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=2 ** 30)
+        app.router.add_post("/recognize", self.handle_recognize)
+        return app
+
+
+async def start_server(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", port).start()
+    return runner
+
+
+class _FakeResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+    def __getitem__(self, key):
+        return self.body[key]
+
+
+class _FakeIndices:
+    def __init__(self, es: "FakeElasticsearch"):
+        self.es = es
+
+    async def exists(self, index: str) -> bool:
+        return index in self.es.indices_created
+
+    async def create(self, index: str, **_):
+        self.es.indices_created.add(index)
+
+
+class FakeElasticsearch:
+    """
+    In-memory sink with the subset of AsyncElasticsearch API used by the pipeline
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.indices_created = set()
+        self.indices = _FakeIndices(self)
+        self.documents: dict[str, dict] = {}
+        self.n_entities = 0
+        self.ids = itertools.count()
+
+    def options(self, **_) -> "FakeElasticsearch":
+        return self
+
+    async def ping(self) -> bool:
+        return True
+
+    async def index(self, index: str, document: dict, **_) -> _FakeResponse:
+        await asyncio.sleep(self.latency)
+        doc_id = str(next(self.ids))
+        self.documents[doc_id] = document
+        return _FakeResponse({"_id": doc_id, "result": "created"})
+
+    async def bulk(self, operations: list, **_) -> _FakeResponse:
+        await asyncio.sleep(self.latency)
+        # every index operation consists of an action line and a source line
+        n_items = len(operations) // 2
+        self.n_entities += n_items
+        items = [{"index": {"_id": str(next(self.ids)), "status": 201}} for _ in range(n_items)]
+        return _FakeResponse({"errors": False, "items": items})
+
+    async def search(self, query: dict, **_) -> _FakeResponse:
+        path = query.get("term", {}).get("path")
+        hits = [{"_id": doc_id} for doc_id, document in self.documents.items() if document.get("path") == path]
+        return _FakeResponse({"hits": {"hits": hits}})
+
+    async def delete_by_query(self, **_) -> _FakeResponse:
+        return _FakeResponse({"deleted": 0})
+
+    async def close(self):
+        pass
+
+
+class _FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    async def run(self, query: str, **_):
+        pass
+
+
+class FakeNeo4jDriver:
+    """
+    Neo4j driver stub which only records executed queries
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.queries: list[tuple[str, dict]] = []
+
+    async def execute_query(self, query: str, parameters: dict = None, **_):
+        await asyncio.sleep(self.latency)
+        self.queries.append((query, json.loads(json.dumps(parameters or {}, default=str))))
+
+    def session(self) -> _FakeSession:
+        return _FakeSession()
+
+    async def close(self):
+        pass
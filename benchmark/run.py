@@ -0,0 +1,156 @@
+"""
+End-to-end benchmark of the pipeline against local stand-ins of Tika, NameTag, Elasticsearch and Neo4j.
+
+Usage: python -m benchmark.run --files 500 --tika-latency 0.05 --nametag-latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="NERvana pipeline benchmark")
+    parser.add_argument("--files", type=int, default=200, help="number of files in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the corpus generator")
+    parser.add_argument("--corpus", help="directory of the corpus, temporary directory is used by default")
+    parser.add_argument("--no-images", dest="images", action="store_false", help="don't generate images for OCR")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="fraction of duplicate files in the corpus")
+    parser.add_argument("--tika-latency", type=float, default=0.05, help="latency of Tika requests in seconds")
+    parser.add_argument("--tika-latency-per-mb", type=float, default=0.5, help="additional Tika latency per MB")
+    parser.add_argument("--nametag-latency", type=float, default=0.02, help="latency of NameTag requests")
+    parser.add_argument("--nametag-latency-per-kb", type=float, default=0.002, help="additional latency per KB")
+    parser.add_argument("--es-latency", type=float, default=0.005, help="latency of Elasticsearch requests")
+    parser.add_argument("--neo4j-latency", type=float, default=0.005, help="latency of Neo4j queries")
+    parser.add_argument("--tika-port", type=int, default=19998)
+    parser.add_argument("--nametag-port", type=int, default=18080)
+    parser.add_argument("--output", help="file to write the JSON report to")
+    return parser.parse_args()
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def clear_pipeline_state(corpus_dir: str):
+    """
+    Remove caches and extracted archives left in the corpus by a previous run, so all files are processed again
+    """
+    from config import config
+    from file_processor.fs_crawler import EXTRACT_DIR_NAME
+
+    for name in os.listdir(corpus_dir):
+        # including journal files of the databases
+        if name.startswith((config.MANIFEST_FILENAME, config.MIME_CACHE_FILENAME)):
+            os.remove(os.path.join(corpus_dir, name))
+    shutil.rmtree(os.path.join(corpus_dir, EXTRACT_DIR_NAME), ignore_errors=True)
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    # pipeline modules read the backend endpoints on import
+    import httpx
+
+    from config import config
+    from file_processor import close_tika_client
+    from pipeline import Pipeline, Manifest
+    from pipeline.workers import initialize_worker
+    from utils import metrics, start_process_pool, shutdown_process_pool, shutdown_io_pools
+    from .corpus import generate_corpus
+    from .fake_backends import FakeTika, FakeNameTag, FakeElasticsearch, FakeNeo4jDriver, start_server
+
+    class BenchmarkPipeline(Pipeline):
+        """
+        Pipeline recording exact latency of every processed file
+        """
+
+        def __init__(self, *pipeline_args):
+            super().__init__(*pipeline_args)
+            self.latencies: list[float] = []
+
+        async def finish(self, file, stage, status):
+            if file.started_at is not None:
+                self.latencies.append(time.perf_counter() - file.started_at)
+            await super().finish(file, stage, status)
+
+    corpus_dir = args.corpus or tempfile.mkdtemp(prefix="nervana_benchmark_")
+    generate_corpus(corpus_dir, args.files, args.seed, args.images, args.duplicates)
+    clear_pipeline_state(corpus_dir)
+    # manifest and cost history of the benchmark don't outlive it
+    state_dir = tempfile.mkdtemp(prefix="nervana_benchmark_state_")
+
+    tika = FakeTika(args.tika_latency, args.tika_latency_per_mb)
+    nametag = FakeNameTag(args.nametag_latency, args.nametag_latency_per_kb)
+    runners = [
+        await start_server(tika.make_app(), args.tika_port),
+        await start_server(nametag.make_app(), args.nametag_port),
+    ]
+    es = FakeElasticsearch(args.es_latency)
+    neo4j_driver = FakeNeo4jDriver(args.neo4j_latency)
+    manifest = Manifest(os.path.join(state_dir, config.MANIFEST_FILENAME), "benchmark")
+    start_process_pool(config.PROCESS_POOL_WORKERS, initialize_worker)
+
+    try:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(300)) as client:
+            pipeline = BenchmarkPipeline(es, client, neo4j_driver, "benchmark", manifest)
+            start = time.perf_counter()
+            await pipeline.run(corpus_dir)
+            duration = time.perf_counter() - start
+    finally:
+        shutdown_process_pool()
+        shutdown_io_pools()
+        await close_tika_client()
+        manifest.close()
+        shutil.rmtree(state_dir, ignore_errors=True)
+        for runner in runners:
+            await runner.cleanup()
+        if not args.corpus:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    latencies = pipeline.latencies
+    return {
+        "files": args.files,
+        "processed_files": len(latencies),
+        "duration_seconds": duration,
+        "files_per_second": len(latencies) / duration if duration else 0,
+        "latency_p50_seconds": percentile(latencies, 50),
+        "latency_p99_seconds": percentile(latencies, 99),
+        "peak_rss_mb": peak_rss_mb(),
+        "indexed_documents": len(es.documents),
+        "indexed_entities": es.n_entities,
+        "tika_requests": tika.requests,
+        "nametag_requests": nametag.requests,
+        "neo4j_queries": len(neo4j_driver.queries),
+        "metrics": metrics.summary()["histograms"],
+    }
+
+
+def main():
+    args = get_arguments()
+    os.environ["TIKA_SERVER_ENDPOINT"] = f"http://localhost:{args.tika_port}"
+    os.environ["NAMETAG_URL"] = f"http://localhost:{args.nametag_port}"
+
+    report = asyncio.run(run_benchmark(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
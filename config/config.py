@@ -2,9 +2,108 @@ from lingua import Language
 
 # -- General --
 
-NUM_WORKERS = 4  # Number of worker coroutines
+STAGE_WORKERS = {
+    "extraction": 8,  # Tika metadata and text extraction
+    "ocr": 16,  # OCR of images, enough to fill EasyOCR batches
+    "ner": 8,  # entity recognition
+    "indexing": 8,  # indexing to Elasticsearch
+    "email": 1,  # indexing of emails to Neo4j
+}  # Number of worker coroutines for each pipeline stage, requests to backends are further limited adaptively
 BATCH_WORKERS = 2  # Number of worker coroutines for batch NER processing
 GPU = False  # Use GPU for available tasks
+QUEUE_SIZE = 100  # Maximum number of files waiting in the queue of each pipeline stage
+MANIFEST_FILENAME = ".nervana_manifest.sqlite"  # manifest of processed files stored in the root directory
+
+# -- Worker pools --
+
+PROCESS_POOL_WORKERS = None  # Number of processes for CPU-heavy tasks (OCR, spaCy), None for number of CPUs
+PRELOAD_MODELS = True  # Load OCR and spaCy models when worker processes start instead of on first use
+IO_POOL_WORKERS = {
+    "default": 4,
+    "filesystem": 4,  # directory traversal and hashing
+    "magic": 8,  # MIME detection
+    "tika": 16,  # reading files uploaded to Tika
+}  # Number of threads of the pools for blocking io
+
+# -- Backends --
+
+# ceiling of concurrent requests and target latency in seconds per MB of the request (smaller ones count as 1 MB),
+# the limit adapts to latency and errors of an overloaded backend
+BACKEND_CONCURRENCY = {
+    "tika": {"max_requests": 8, "target_latency": 60},  # per Tika server
+    "nametag": {"max_requests": 8, "target_latency": 30},
+    "elasticsearch": {"max_requests": 8, "target_latency": 10},
+}
+CIRCUIT_BREAKER_FAILURES = 5  # consecutive failures of a backend after which calls to it are stopped
+CIRCUIT_BREAKER_RESET_SECONDS = 30  # time after which calls to a failing backend are tried again
+RETRY_BUDGET_RATIO = 0.2  # retries allowed per call of any backend
+RETRY_BUDGET_MIN_PER_SECOND = 1  # retries allowed per second regardless of the number of calls
+MAX_PARKED_RETRIES = 10  # times a file waiting for an unavailable backend is retried before it fails
+
+# -- Tika --
+
+TIKA_TIMEOUT = 180  # seconds
+TIKA_UPLOAD_CHUNK_SIZE = 2 ** 20  # files are streamed to Tika in chunks of this size
+TIKA_EJECT_FAILURES = 3  # consecutive failed requests after which a Tika server stops receiving files
+TIKA_HEALTH_CHECK_SECONDS = 10  # interval of checking which Tika servers are available
+TIKA_HEALTH_CHECK_TIMEOUT = 5  # seconds
+
+# -- Crawling --
+
+MIME_CACHE_FILENAME = ".nervana_mime_cache.sqlite"  # cache of detected file formats stored in the root directory
+MAGIC_HEADER_SIZE = 2 ** 16  # number of bytes from the beginning of a file used to detect its format
+MIME_DETECTION_BATCH = 256  # number of files whose format is detected in parallel
+ARCHIVE_MODE = "stream"  # "stream" reads zip and uncompressed tar archives directly, "extract" extracts all archives
+ARCHIVE_WORKERS = 2  # Number of archives extracted in parallel in the worker processes
+WATCH_DEBOUNCE_SECONDS = 5  # in watch mode, files are processed once they weren't modified for this long
+
+# -- Scheduling --
+
+SCHEDULER_BACKFILL_WORKERS = {
+    "extraction": 1,
+    "ocr": 0,
+}  # stages scheduled by estimated cost and their number of workers which take the cheapest files
+SCHEDULER_DEFAULT_COST = (0.5, 1.0)  # estimated seconds per file and per MB of unknown formats
+SCHEDULER_FORMAT_COSTS = {
+    "extraction": {
+        ".pdf": (1, 2),
+        ".pst": (5, 3),
+        ".mbox": (2, 1),
+        ".msg": (0.5, 1),
+        ".xlsx": (1, 3),
+        ".xls": (1, 3),
+        # only metadata, the text is recognized in the ocr stage
+        ".png": (0.2, 0.1),
+        ".jpg": (0.2, 0.1),
+        ".jpeg": (0.2, 0.1),
+        ".tiff": (0.2, 0.1),
+        ".bmp": (0.2, 0.1),
+    },
+    "ocr": {
+        ".png": (10, 5),
+        ".jpg": (10, 5),
+        ".jpeg": (10, 5),
+        ".tiff": (10, 5),
+        ".bmp": (10, 5),
+    },
+}  # estimated seconds per file and per MB in each stage used until enough history is collected
+SCHEDULER_MIN_SAMPLES = 10  # number of observed files of a format in a stage needed to use the learned estimate
+
+# -- Metrics --
+
+METRICS_PORT = 9797  # port of the Prometheus metrics endpoint, None to disable
+METRICS_SUMMARY_FILE = "nervana_metrics.json"  # JSON summary of metrics written at the end of the run
+
+# -- Service mode --
+
+SERVICE_PORT = 9101  # local port of the job API, used unless a Unix socket is given
+SERVICE_MAX_JOBS = 1  # number of jobs processed at the same time, others wait in the queue
+
+# -- Distributed mode --
+
+WORK_QUEUE_LEASE_SECONDS = 300  # files leased by a node without heartbeat for this long are delivered again
+WORK_QUEUE_POLL_SECONDS = 5  # interval of polling the work queue when it's empty
+WORK_QUEUE_MAX_ATTEMPTS = 3  # files delivered more times are marked as failed
 
 # -- File processing --
 
@@ -69,6 +168,9 @@ SUPPORTED_FORMATS = [
     ".m3u",
 ]
 
+DEDUPLICATE = True  # process files with identical content only once
+DEDUPLICATION_CACHE_SIZE = 1000  # number of processed files kept in memory for reuse by their duplicates
+
 # -- OCR --
 
 OCR_FROMATS = (
@@ -80,9 +182,20 @@ OCR_FROMATS = (
     ".bmp",
 )  # files that can be processed by OCR
 TESSERACT_LANG_STRING = "eng+ces+slk+pol+deu+spa"
-TESSERACT_CONFIG = r"--oem 3 --psm 6"
+TESSERACT_BACKEND = "tesserocr"  # "tesserocr" keeps Tesseract loaded in each process, "pytesseract" runs it per call
+TESSERACT_OEM = 3  # OCR engine mode, default
+TESSERACT_PSM = 6  # page segmentation mode, single uniform block of text
+TESSERACT_CONFIG = f"--oem {TESSERACT_OEM} --psm {TESSERACT_PSM}"
+ORIENTATION_DETECTION = "osd"  # "osd" (Tesseract), "thumbnail" (OCR of a downscaled image) or "brute_force"
+ORIENTATION_OSD_MIN_CONFIDENCE = 2.0  # orientation confidence of Tesseract OSD below which all rotations are tried
+ORIENTATION_THUMBNAIL_SIZE = 800  # longer side of the downscaled image in pixels
+ORIENTATION_MIN_CONFIDENCE = 0.8  # language confidence at the detected orientation below which all rotations are tried
+OCR_EARLY_EXIT_CONFIDENCE = 0.95  # language confidence of Tesseract text above which EasyOCR is skipped, >1 disables
 EASYOCR_DEFAULT_LANGS = ["en", "cs", "sk", "pl", "de", "es"]
 EASYOCR_MODELS_DIR = "./assets/easyocr_models"  # path to easyocr models directory
+EASYOCR_READER_CACHE_SIZE = 4  # number of EasyOCR readers (language sets) kept loaded in each worker process
+EASYOCR_BATCH_SIZE = 8  # images of different files in the same languages recognized by EasyOCR at once
+EASYOCR_BATCH_MAX_LATENCY = 0.5  # seconds an image waits for others to fill the batch
 
 # -- Language detection --
 
@@ -107,6 +220,14 @@ SUPPORTED_LANGUAGES = [
 # -- Entity recognition --
 CONTEXT_LENGTH = 200  # length of the entity context in characters
 
+NEAR_DUPLICATE_DETECTION = True  # reuse entities of near-duplicate documents
+NEAR_DUPLICATE_THRESHOLD = 0.8  # minimal estimated Jaccard similarity of near-duplicate documents
+NEAR_DUPLICATE_MIN_SHINGLES = 50  # shorter documents are always processed whole
+NEAR_DUPLICATE_INDEX_SIZE = 10000  # number of documents kept in the similarity index
+SHINGLE_SIZE = 5  # number of words in a shingle
+MINHASH_PERMUTATIONS = 128  # length of the MinHash signature
+LSH_BANDS = 32  # number of bands for locality-sensitive hashing, must divide MINHASH_PERMUTATIONS
+
 LANGUAGE_TO_SPACY_MODEL = {
     Language.FRENCH: "fr_core_news_sm",
     Language.POLISH: "pl_core_news_sm",
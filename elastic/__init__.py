@@ -1,2 +1,2 @@
 from elastic.client import get_async_elastic_client, test_connection_async
-from elastic.index_data import assert_index_exists, index_file
+from elastic.index_data import assert_index_exists, index_file, delete_file_documents
@@ -1,10 +1,13 @@
 import json
 import os
 
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import ApiError, AsyncElasticsearch, ConnectionError, ConnectionTimeout
 from elasticsearch.helpers import async_bulk
 
 from file_processor import File
+from utils import metrics, get_limiter, exponential_backoff_async, get_circuit_breaker
+
+RETRY_EXCEPTIONS = [ConnectionError, ConnectionTimeout]
 
 
 async def assert_index_exists(es: AsyncElasticsearch, index_name: str):
@@ -20,8 +23,32 @@ async def assert_index_exists(es: AsyncElasticsearch, index_name: str):
 
 async def index_file(es: AsyncElasticsearch, dataset: str, file: File):
     file_document = file.make_document()
-    res = await es.index(index=dataset, document=file_document)
+
+    async def index_document():
+        async with get_limiter("elasticsearch").slot(len(file.plaintext), RETRY_EXCEPTIONS) as slot:
+            with metrics.timer("elasticsearch_index_seconds", operation="file"):
+                try:
+                    return await es.index(index=dataset, document=file_document)
+                except ApiError as e:
+                    slot.check_status(e.status_code)
+                    raise
+
+    async def index_entities():
+        # approximate size of the request, entity documents are small
+        size = sum(len(entity.context) + len(entity.value) for entity in file.entities)
+        async with get_limiter("elasticsearch").slot(size, RETRY_EXCEPTIONS):
+            with metrics.timer("elasticsearch_index_seconds", operation="entities"):
+                return await async_bulk(es, actions)
+
+    res = await exponential_backoff_async(
+        index_document,
+        retry_exceptions=RETRY_EXCEPTIONS,
+        breaker=get_circuit_breaker("elasticsearch"),
+    )
     file_id = res['_id']
+    if not file.entities:
+        # e.g. duplicates, they only reference the document of the original
+        return
 
     actions = [
         {
@@ -32,4 +59,22 @@ async def index_file(es: AsyncElasticsearch, dataset: str, file: File):
         for entity in file.entities
     ]
 
-    await async_bulk(es, actions)
+    await exponential_backoff_async(
+        index_entities,
+        retry_exceptions=RETRY_EXCEPTIONS,
+        breaker=get_circuit_breaker("elasticsearch"),
+    )
+
+
+async def delete_file_documents(es: AsyncElasticsearch, dataset: str, path: str):
+    """
+    Delete documents of the file with given path together with its entities
+    """
+    res = await es.search(index=dataset, query={"term": {"path": path}}, source=False, size=1000)
+    file_ids = [hit["_id"] for hit in res["hits"]["hits"]]
+    if not file_ids:
+        return
+
+    queries = [{"ids": {"values": file_ids}}]
+    queries.extend({"parent_id": {"type": "entity", "id": file_id}} for file_id in file_ids)
+    await es.delete_by_query(index=dataset, query={"bool": {"should": queries}}, refresh=True)
@@ -1,12 +1,13 @@
 import os
 
 from bs4 import BeautifulSoup
-from httpx import AsyncClient
+from httpx import AsyncClient, TransportError
 from lingua import Language
 from ufal.morphodita import *
 
 from config import config
-from utils import setup_logger
+from utils import setup_logger, metrics, get_limiter, exponential_backoff_async, get_circuit_breaker
+from utils.exceptions import ServerError
 from utils.text import get_context
 from .entity import Entity
 from .post_processor import Lemmatizer, is_eligible_value
@@ -24,8 +25,22 @@ async def tokenize_data(client: AsyncClient, data: str, language: Language):
     url = f"{base_url}/recognize"
     model = config.LANGUGAGE_TO_NAMETAG_MODEL[language]
     payload = {'data': data}
-    response = await client.post(url, data=payload, params={"model": model})
-    response.raise_for_status()
+
+    async def send_request():
+        async with get_limiter("nametag").slot(len(data), [TransportError]) as slot:
+            with metrics.timer("nametag_request_seconds"):
+                response = await client.post(url, data=payload, params={"model": model})
+            slot.check_status(response.status_code)
+            if response.status_code >= 500:
+                raise ServerError(f"NameTag returned {response.status_code} code")
+            response.raise_for_status()
+        return response
+
+    response = await exponential_backoff_async(
+        send_request,
+        retry_exceptions=[TransportError, ServerError],
+        breaker=get_circuit_breaker("nametag"),
+    )
     return response.json()['result']
 
 
@@ -33,9 +48,9 @@ def get_entities(tokenized, is_tabular: bool, language: Language) -> list[Entity
     entities = []
     entities_set = set()
 
-    soup = BeautifulSoup(tokenized, "html.parser")
-
-    tokenized_entities = soup.find_all("ne")
+    with metrics.timer("html_parsing_seconds"):
+        soup = BeautifulSoup(tokenized, "html.parser")
+        tokenized_entities = soup.find_all("ne")
 
     for tokenized_entity in tokenized_entities:
         if tokenized_entity.parent not in soup.contents:  # means it's a part of a container and will be processed later
@@ -67,7 +82,8 @@ def get_entities(tokenized, is_tabular: bool, language: Language) -> list[Entity
             elif language == Language.ENGLISH:
                 tagger = english_tagger
             try:
-                lemmatized_value = Lemmatizer.lemmatize_text(entity_value, tagger)
+                with metrics.timer("lemmatization_seconds"):
+                    lemmatized_value = Lemmatizer.lemmatize_text(entity_value, tagger)
             except Exception as e:
                 logger.error(f"Failed to lemmatize {entity_value}, error: {e}")
                 lemmatized_value = entity_value
@@ -39,14 +39,19 @@ async def batch_with_semaphore(sem: Semaphore, client: AsyncClient, plaintext: s
         return await process_batch(client, plaintext, language, is_tabular)
 
 
-async def find_entities_in_file(client: AsyncClient, file: "File") -> list[Entity]:
+async def find_entities_in_file(client: AsyncClient, file: "File", plaintext: str | None = None) -> list[Entity]:
+    """
+    Find entities in the plaintext of the file
+    :param plaintext: part of the plaintext to process instead of the whole file
+    """
     # Create a semaphore with a batch limit for this specific file
     batch_workers = config.BATCH_WORKERS
     sem = Semaphore(batch_workers)
 
     is_tabular = file.format in config.TABULAR_FORMATS
 
-    plaintext = file.plaintext
+    if plaintext is None:
+        plaintext = file.plaintext
     entities = []
 
     # split large texts into smaller batches
@@ -0,0 +1,143 @@
+import random
+import zlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+from lingua import Language
+
+from config import config
+from utils import run_sync_fn_async_cpu
+from .entity import Entity
+
+# prevent cyclic import
+if TYPE_CHECKING:
+    from file_processor import File
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# number of shingles hashed at once, bounds the memory used for long documents
+_SIGNATURE_CHUNK_SIZE = 4096
+
+
+def split_segments(plaintext: str) -> list[str]:
+    return [line for line in plaintext.split("\n") if line.strip()]
+
+
+def segment_hash(segment: str) -> int:
+    return zlib.crc32(segment.strip().encode())
+
+
+def get_shingles(plaintext: str, size: int) -> np.ndarray:
+    words = plaintext.lower().split()
+    shingles = {zlib.crc32(" ".join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)}
+    return np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signature(plaintext: str, a: np.ndarray, b: np.ndarray) -> Optional[np.ndarray]:
+    shingles = get_shingles(plaintext, config.SHINGLE_SIZE)
+    if len(shingles) < config.NEAR_DUPLICATE_MIN_SHINGLES:
+        # too short documents are processed anyway
+        return None
+
+    signature = np.full(len(a), _MAX_HASH, dtype=np.uint64)
+    # permutations are allowed to overflow, they are still valid hash functions
+    with np.errstate(over="ignore"):
+        for start in range(0, len(shingles), _SIGNATURE_CHUNK_SIZE):
+            chunk = shingles[start:start + _SIGNATURE_CHUNK_SIZE]
+            hashes = (np.outer(chunk, a) + b) % _MERSENNE_PRIME & _MAX_HASH
+            np.minimum(signature, hashes.min(axis=0), out=signature)
+    return signature
+
+
+class IndexedDocument:
+    def __init__(self, doc_id: int, name: str, signature: np.ndarray, language: Language, is_tabular: bool,
+                 segments: set[int], entities: list[Entity]):
+        self.doc_id = doc_id
+        self.name = name
+        self.signature = signature
+        self.language = language
+        self.is_tabular = is_tabular
+        self.segments = segments
+        self.entities = entities
+
+
+class SimilarityIndex:
+    """
+    MinHash signatures of processed documents with locality-sensitive hashing
+    for fast lookup of near-duplicate documents
+    """
+
+    def __init__(self, threshold: float, num_perm: int, bands: int, max_documents: int):
+        if num_perm % bands:
+            raise ValueError("Number of permutations must be divisible by number of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_documents = max_documents
+
+        generator = random.Random(42)
+        self.a = np.array([generator.randint(1, (1 << 61) - 2) for _ in range(num_perm)], dtype=np.uint64)
+        self.b = np.array([generator.randint(0, (1 << 61) - 2) for _ in range(num_perm)], dtype=np.uint64)
+
+        self.documents: OrderedDict[int, IndexedDocument] = OrderedDict()
+        self.buckets: list[dict[bytes, set[int]]] = [{} for _ in range(bands)]
+        self.next_id = 0
+
+    async def signature(self, plaintext: str) -> Optional[np.ndarray]:
+        """
+        MinHash signature of the document computed in a worker process, None for too short documents
+        """
+        return await run_sync_fn_async_cpu(minhash_signature, plaintext, self.a, self.b)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def find_similar(self, file: "File", signature: np.ndarray) -> Optional[IndexedDocument]:
+        """
+        Find the most similar indexed document with the same language
+        :return: None if no document is similar at least to the threshold
+        """
+        candidates = set()
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+
+        is_tabular = file.format in config.TABULAR_FORMATS
+        best_document = None
+        best_similarity = self.threshold
+        for doc_id in candidates:
+            document = self.documents[doc_id]
+            if document.language != file.language or document.is_tabular != is_tabular:
+                continue
+            # fraction of equal minhashes estimates the Jaccard similarity
+            similarity = float(np.mean(document.signature == signature))
+            if similarity >= best_similarity:
+                best_similarity = similarity
+                best_document = document
+
+        if best_document is not None:
+            self.documents.move_to_end(best_document.doc_id)
+        return best_document
+
+    def add(self, file: "File", signature: np.ndarray):
+        segments = {segment_hash(segment) for segment in split_segments(file.plaintext)}
+        is_tabular = file.format in config.TABULAR_FORMATS
+        doc_id = self.next_id
+        self.next_id += 1
+        document = IndexedDocument(doc_id, str(file), signature, file.language, is_tabular, segments, file.entities)
+        self.documents[doc_id] = document
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(key, set()).add(doc_id)
+
+        if len(self.documents) > self.max_documents:
+            self._evict()
+
+    def _evict(self):
+        doc_id, document = self.documents.popitem(last=False)
+        for bucket, key in zip(self.buckets, self._band_keys(document.signature)):
+            ids = bucket.get(key)
+            if ids is None:
+                continue
+            ids.discard(doc_id)
+            if not ids:
+                del bucket[key]
@@ -1,10 +1,22 @@
+from functools import lru_cache
+
 import spacy
 from lingua import Language
 
 from config import config
 from entity_recognizer import Entity
 from entity_recognizer.post_processor import is_eligible_value
-from utils import get_context
+from utils import get_context, metrics
+
+
+@lru_cache(maxsize=None)
+def load_model(model: str) -> spacy.language.Language:
+    return spacy.load(model)
+
+
+def warm_up():
+    for model in config.LANGUAGE_TO_SPACY_MODEL.values():
+        load_model(model)
 
 
 def run_spacy(plaintext: str, language: Language, is_tabular: bool) -> list[Entity]:
@@ -12,8 +24,9 @@ def run_spacy(plaintext: str, language: Language, is_tabular: bool) -> list[Enti
     entities_set = set()
     model = config.LANGUAGE_TO_SPACY_MODEL[language]
 
-    nlp = spacy.load(model)
-    doc = nlp(plaintext)
+    with metrics.timer("spacy_seconds", model=model):
+        nlp = load_model(model)
+        doc = nlp(plaintext)
 
     for ent in doc.ents:
         entity_value = ent.text
@@ -1,2 +1,4 @@
 from .file import File
-from .fs_crawler import get_files
+from .fs_crawler import get_files, walk_files, iter_files
+from .tika_client import close_tika_client
+from .watcher import Watcher
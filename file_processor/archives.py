@@ -0,0 +1,106 @@
+import os
+import tarfile
+import time
+import zipfile
+from contextlib import ExitStack, contextmanager
+from typing import BinaryIO, Iterator, Union
+
+# separates the path of an archive from the path of its member, e.g. archive.zip!/dir/file.pdf
+ARCHIVE_SEPARATOR = "!/"
+# suffixes of archives whose members can be read without extracting them, members of compressed tar archives
+# can't be accessed randomly, each read would decompress the archive up to the member
+STREAMABLE_SUFFIXES = (".zip", ".tar")
+
+Container = Union[zipfile.ZipFile, tarfile.TarFile]
+
+
+class NotStreamableError(Exception):
+    pass
+
+
+def is_virtual(path: str) -> bool:
+    return ARCHIVE_SEPARATOR in path
+
+
+def member_path(archive_path: str, member: str) -> str:
+    return f"{archive_path}{ARCHIVE_SEPARATOR}{member}"
+
+
+def open_container(fileobj: BinaryIO) -> Container:
+    """
+    Open zip or uncompressed tar archive from a seekable file object
+    :raises NotStreamableError: if it isn't a zip or uncompressed tar archive
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        return zipfile.ZipFile(fileobj)
+    fileobj.seek(0)
+    try:
+        return tarfile.open(fileobj=fileobj, mode="r:")
+    except tarfile.ReadError:
+        raise NotStreamableError("not a zip or uncompressed tar archive")
+
+
+def iter_members(container: Container) -> Iterator[tuple[str, int, float]]:
+    """
+    Yields name, size and modification time of regular files in the archive
+    """
+    if isinstance(container, zipfile.ZipFile):
+        for info in container.infolist():
+            if not info.is_dir():
+                yield info.filename, info.file_size, time.mktime(info.date_time + (0, 0, -1))
+    else:
+        for info in container:
+            if info.isfile():
+                yield info.name, info.size, float(info.mtime)
+
+
+def is_stored(container: Container, name: str) -> bool:
+    """
+    Whether the member is stored uncompressed, so reading it from the middle doesn't decompress it from the start
+    """
+    if isinstance(container, zipfile.ZipFile):
+        return container.getinfo(name).compress_type == zipfile.ZIP_STORED
+    # only uncompressed tar archives are opened
+    return True
+
+
+def open_member(container: Container, name: str) -> BinaryIO:
+    if isinstance(container, zipfile.ZipFile):
+        return container.open(name)
+    member = container.extractfile(name)
+    if member is None:
+        raise FileNotFoundError(name)
+    return member
+
+
+@contextmanager
+def open_path(path: str) -> Iterator[BinaryIO]:
+    """
+    Open a file for binary reading, members of (nested) archives are read directly from the archive
+    :param path: path on disk or virtual path like archive.zip!/inner.tar!/file.pdf
+    """
+    archive_path, *members = path.split(ARCHIVE_SEPARATOR)
+    with ExitStack() as stack:
+        fileobj = stack.enter_context(open(archive_path, "rb"))
+        for member in members:
+            container = stack.enter_context(open_container(fileobj))
+            fileobj = stack.enter_context(open_member(container, member))
+        yield fileobj
+
+
+def stat_path(path: str) -> tuple[int, float]:
+    """
+    Size and modification time of a file on disk or an archive member
+    """
+    if not is_virtual(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+
+    archive_path, member = path.rsplit(ARCHIVE_SEPARATOR, 1)
+    with open_path(archive_path) as fileobj, open_container(fileobj) as container:
+        if isinstance(container, zipfile.ZipFile):
+            info = container.getinfo(member)
+            return info.file_size, time.mktime(info.date_time + (0, 0, -1))
+        info = container.getmember(member)
+        return info.size, float(info.mtime)
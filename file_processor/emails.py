@@ -1,6 +1,8 @@
 from neo4j import AsyncDriver
+from neo4j.exceptions import ServiceUnavailable, SessionExpired
 
-from utils import setup_logger
+from utils import setup_logger, metrics, exponential_backoff_async, get_circuit_breaker
+from utils.exceptions import CircuitOpenError
 
 logger = setup_logger(__name__)
 
@@ -16,7 +18,16 @@ async def index_email(neo4j_driver: AsyncDriver, sender: str, recipients: list[s
         MERGE (e)-[:RECEIVED_BY]->(r)
         """
     parameters = {'sender': sender, 'recipients': recipients, 'subject': subject, 'path': path}
-    await neo4j_driver.execute_query(query, parameters)
+
+    async def execute_query():
+        with metrics.timer("neo4j_query_seconds"):
+            await neo4j_driver.execute_query(query, parameters)
+
+    await exponential_backoff_async(
+        execute_query,
+        retry_exceptions=[ServiceUnavailable, SessionExpired],
+        breaker=get_circuit_breaker("neo4j"),
+    )
 
 
 async def process_email(neo4j_driver: AsyncDriver, file_path, metadata):
@@ -31,6 +42,9 @@ async def process_email(neo4j_driver: AsyncDriver, file_path, metadata):
         try:
             await index_email(neo4j_driver, sender, recipients, subject, file_path)
             logger.info(f"{file_path}: indexed email")
+        except CircuitOpenError:
+            # the email is indexed again once Neo4j is available
+            raise
         except Exception as e:
             logger.error(f"{file_path}: Error while indexing email - {e}")
     else:
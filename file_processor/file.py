@@ -2,15 +2,15 @@ from datetime import datetime
 from pathlib import PurePath
 from typing import Optional
 
-from httpx import AsyncClient
+from httpx import AsyncClient, HTTPError
 from lingua import Language, IsoCode639_1
-from neo4j import AsyncDriver
 
 from config import config
 from entity_recognizer import Entity
 from entity_recognizer.recognition_manager import find_entities_in_file
-from utils import setup_logger, filter_for_lang_detection, run_sync_fn_async_cpu, generic_filter
-from .emails import process_email
+from entity_recognizer.similarity import SimilarityIndex, IndexedDocument, split_segments, segment_hash
+from utils import setup_logger, filter_for_lang_detection, generic_filter, get_context
+from utils.exceptions import CircuitOpenError, ServerError
 from .metadata import extension_from_mime, determine_text_language
 from .ocr import run_ocr
 from .tika_client import call_tika_async
@@ -22,6 +22,20 @@ class File:
     def __init__(self, path: str, file_format: Optional[str] = None):
         self.path_obj = PurePath(path)
         self.format = file_format
+        self.size = 0
+        self.mtime = 0.0
+        self.content_hash: Optional[str] = None
+        # documents from previous run might exist in the index
+        self.stale = False
+        # path of the file with identical content whose results are reused
+        self.duplicate_of: Optional[str] = None
+        # start of the processing, used to measure latency
+        self.started_at: Optional[float] = None
+        # number of times the file was parked because a backend was unavailable
+        self.times_parked = 0
+        self.metadata: dict = {}
+        # plaintext returned by Tika together with the metadata
+        self.tika_content: Optional[str] = None
         self.plaintext = ""
         self.language: Optional[Language] = None
         self.author = "unknown"
@@ -37,12 +51,21 @@ class File:
     def filename(self):
         return self.path_obj.name
 
-    async def process(self, client: AsyncClient, neo4j_driver: AsyncDriver):
-        tika_response = await call_tika_async(self.path, "meta")
+    @property
+    def is_email(self):
+        return self.format in config.EMAIL_FORMATS
+
+    @property
+    def needs_ocr(self):
+        return self.format in config.OCR_FROMATS
+
+    async def extract_metadata(self) -> bool:
+        # plaintext of images is extracted by OCR, so only their metadata are needed
+        tika_response = await call_tika_async(self.path, self.size, with_text=not self.needs_ocr)
         metadata = tika_response["metadata"]
         if not metadata:
             logger.error(f"{self}: cannot extract metadata using tika")
-            return
+            return False
 
         # use tika mime even if detected before by magic
         # use magic as fallback if available
@@ -52,56 +75,124 @@ class File:
             self.format = tika_extension
         elif self.format is None:
             logger.error(f"{self}: cannot determine file format")
-            return
-
-        # handle emails
-        if self.format in config.EMAIL_FORMATS:
-            await process_email(neo4j_driver, self.path, metadata)
-
-        if self.format in config.OCR_FROMATS:
-            # language is detected by OCR because it's used for model selection
-            plaintext, language = await run_sync_fn_async_cpu(run_ocr, self.path)
-        else:
-            tika_response = await call_tika_async(self.path, "text")
-            plaintext = tika_response["content"] or ""
-            plaintext = generic_filter(plaintext)
-            filtered_text = filter_for_lang_detection(plaintext)
-            language, _ = determine_text_language(filtered_text)
-
+            return False
+
+        self.metadata = metadata
+        self.tika_content = tika_response["content"]
+        return True
+
+    async def extract_text(self) -> bool:
+        if self.tika_content is None:
+            tika_response = await call_tika_async(self.path, self.size)
+            self.tika_content = tika_response["content"]
+        plaintext = self.tika_content or ""
+        self.tika_content = None
+        plaintext = generic_filter(plaintext)
+        filtered_text = filter_for_lang_detection(plaintext)
+        language, _ = determine_text_language(filtered_text)
+        return self.set_plaintext(plaintext, language)
+
+    async def ocr(self) -> bool:
+        # language is detected by OCR because it's used for model selection
+        plaintext, language = await run_ocr(self.path)
+        return self.set_plaintext(plaintext, language)
+
+    def set_plaintext(self, plaintext: Optional[str], language: Optional[Language]) -> bool:
         if not plaintext:
             logger.error(f"{self}: cannot extract plaintext")
-            return
+            return False
 
         if not language or language not in config.SUPPORTED_LANGUAGES:
             # try to use language from tika
-            tika_lang = metadata.get("language")
+            tika_lang = self.metadata.get("language")
             if not tika_lang:
                 logger.error(f"{self}: cannot determine language")
-                return
+                return False
             iso_code = IsoCode639_1[tika_lang.upper()]
             parsed_lang = Language.from_iso_code_639_1(iso_code)
             if parsed_lang in config.SUPPORTED_LANGUAGES:
                 language = parsed_lang
             else:
                 logger.error(f"{self}: unsupported language {language}")
-                return
+                return False
 
         self.plaintext = plaintext
         self.language = language
-        self.timestamp = metadata.get("dcterms:created")
-        self.author = metadata.get("dc:creator", "unknown")
+        self.timestamp = self.metadata.get("dcterms:created")
+        self.author = self.metadata.get("dc:creator", "unknown")
 
         # file is marked as valid because if something goes wrong during entity recognition
         # at least the metadata and plaintext will be saved
         self.valid = True
+        return True
 
+    async def recognize_entities(self, client: AsyncClient, similarity_index: Optional[SimilarityIndex] = None):
         try:
-            self.entities = await find_entities_in_file(client, self)
+            signature = await similarity_index.signature(self.plaintext) if similarity_index else None
+            similar = similarity_index.find_similar(self, signature) if signature is not None else None
+            if similar:
+                self.entities = await self.reuse_entities(client, similar)
+            else:
+                self.entities = await find_entities_in_file(client, self)
+            if signature is not None:
+                similarity_index.add(self, signature)
+        except (CircuitOpenError, HTTPError, ServerError):
+            # entities are recognized again once the backend is available, otherwise the file fails
+            # instead of being indexed without entities
+            raise
         except Exception as e:
             logger.error(f"{self}: Error while recognizing entities {e}")
-            return
+
+    async def reuse_entities(self, client: AsyncClient, similar: IndexedDocument) -> list[Entity]:
+        """
+        Reuse entities of a near-duplicate document, only the segments that differ are processed
+        """
+        common, differing = [], []
+        for segment in split_segments(self.plaintext):
+            if segment_hash(segment) in similar.segments:
+                common.append(segment)
+            else:
+                differing.append(segment)
+        logger.info(f"{self}: near-duplicate of {similar.name}, processing {len(differing)} differing segments")
+
+        common_text = "\n".join(common)
+        entities = [
+            Entity(entity.entity_type, entity.value, entity.lemmatized, get_context(entity.value, self.plaintext))
+            for entity in similar.entities
+            if entity.value in common_text
+        ]
+        if not differing:
+            return entities
+
+        new_entities = await find_entities_in_file(client, self, "\n".join(differing))
+        if self.format in config.TABULAR_FORMATS:
+            # duplicate entities are removed in tabular data
+            seen = {entity.value.lower() for entity in entities}
+            new_entities = [entity for entity in new_entities if entity.value.lower() not in seen]
+        entities.extend(new_entities)
+        return entities
+
+    def copy_results(self, original: "File"):
+        """
+        Reuse results of a file with identical content, the file is indexed only as a reference to the original
+        """
+        self.format = original.format
+        # emails are still indexed to Neo4j from the metadata
+        self.metadata = original.metadata
+        self.duplicate_of = original.path
 
     def make_document(self):
+        if self.duplicate_of:
+            return {
+                "filename": self.filename,
+                "path": self.path,
+                "format": self.format,
+                "duplicate_of": self.duplicate_of,
+                "entities": {
+                    "name": "file",
+                }
+            }
+
         return {
             "filename": self.filename,
             "path": self.path,
@@ -110,6 +201,7 @@ class File:
             "language": self.language.iso_code_639_1.name.lower(),
             "author": self.author,
             "timestamp": self.timestamp,
+            "duplicate_of": self.duplicate_of,
             "entities": {
                 "name": "file",
             }
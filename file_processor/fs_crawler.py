@@ -1,86 +1,308 @@
 import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from functools import partial
+from itertools import islice
+from typing import AsyncIterator, Iterator, Optional
 
 from pyunpack import Archive
 
 from config import config
-from utils import setup_logger
+from utils import setup_logger, run_sync_fn_async_io, get_process_pool, get_io_pool
+from .archives import (
+    STREAMABLE_SUFFIXES,
+    Container,
+    NotStreamableError,
+    is_stored,
+    iter_members,
+    member_path,
+    open_container,
+    open_member,
+)
 from .file import File
-from .metadata import get_file_format_magic, extension_from_mime
+from .metadata import get_file_format_magic, get_buffer_format_magic, extension_from_mime
+from .mime_cache import MimeCache
 
 # suffixes of archives that can be extracted
 archives_suffixes = (".zip", ".rar", ".7z", ".tar", ".gz", ".bz2", ".xz", ".lzma", ".z", ".Z", ".lz")
+EXTRACT_DIR_NAME = "_extracted_by_NERvana"  # directory in the root directory to extract archives to
+# suffixes of directories with extracted and partially extracted archives
+EXTRACTED_SUFFIX = ".extracted"
+PARTIAL_SUFFIX = ".partial"
+# databases of the pipeline and their journal files
+IGNORED_PREFIXES = (config.MANIFEST_FILENAME, config.MIME_CACHE_FILENAME)
 
 logger = setup_logger(__name__)
 
 
-def extract_archive(archive_path: str, extract_dir: str):
-    Archive(archive_path).extractall(extract_dir)
+def extract_archive(archive_path: str, target_dir: str):
+    # an interrupted extraction mustn't be mistaken for a finished one in the next run, and extractions
+    # of the same archive by other nodes or by the watcher mustn't overwrite each other
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    partial_dir = tempfile.mkdtemp(prefix=f"{os.path.basename(target_dir)}.", suffix=PARTIAL_SUFFIX,
+                                   dir=os.path.dirname(target_dir))
+    try:
+        Archive(archive_path).extractall(partial_dir)
+        try:
+            os.rename(partial_dir, target_dir)
+        except OSError:
+            if not os.path.isdir(target_dir):
+                raise
+            # extracted by another node or the watcher meanwhile
+    finally:
+        # nothing is left after a successful rename
+        shutil.rmtree(partial_dir, ignore_errors=True)
 
 
-def get_files(root_dir: str) -> list[File]:
+def get_extraction_dir(archive_path: str, root_dir: str, extract_dir: str) -> str:
     """
-    Returns all absolute file paths reachable from given root directory
+    Each archive is extracted into its own directory, nested archives next to themselves
+    """
+    if archive_path.startswith(extract_dir + os.sep):
+        return f"{archive_path}{EXTRACTED_SUFFIX}"
+    return os.path.join(extract_dir, f"{os.path.relpath(archive_path, root_dir)}{EXTRACTED_SUFFIX}")
+
+
+def is_extraction_dir(path: str, extract_dir: str) -> bool:
+    return path.startswith(extract_dir + os.sep) and path.endswith((EXTRACTED_SUFFIX, PARTIAL_SUFFIX))
+
+
+def iter_file_paths(directory: str, extract_dir: str) -> Iterator[str]:
+    """
+    Yields paths of all regular files in the directory tree
+    """
+    if not os.path.isdir(directory):
+        yield directory
+        return
+
+    directories = [directory]
+    while directories:
+        try:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # extracted archives are scanned once their archive is found, unfinished extractions never
+                        if entry.path != extract_dir and not is_extraction_dir(entry.path, extract_dir):
+                            directories.append(entry.path)
+                    elif entry.is_file() and not entry.name.startswith(IGNORED_PREFIXES):
+                        yield entry.path
+        except OSError as e:
+            logger.warning(f"Cannot read directory: {e}")
+
+
+def detect_formats(file_paths: list[str],
+                   mime_cache: MimeCache) -> Iterator[tuple[str, Optional[str], os.stat_result]]:
+    """
+    Detect MIME types of files not found in the cache in parallel
+    """
+    paths, stats = [], []
+    for file_path in file_paths:
+        try:
+            stats.append(os.stat(file_path))
+            paths.append(file_path)
+        except OSError as e:
+            # e.g. removed since the directory was read
+            logger.warning(f"{file_path} skipped - {e}")
+    mimes = [mime_cache.get(stat) for stat in stats]
+    detections = {
+        i: get_io_pool("magic").submit(partial(get_file_format_magic, paths[i]))
+        for i, mime in enumerate(mimes)
+        if mime is None
+    }
+
+    detected = []
+    for i, detection in detections.items():
+        try:
+            mimes[i] = detection.result()
+            detected.append((stats[i], mimes[i]))
+        except Exception as e:
+            logger.warning(f"{paths[i]} - cannot detect file format: {e}")
+    mime_cache.put_many(detected)
+
+    for file_path, mime, stat in zip(paths, mimes, stats):
+        yield file_path, extension_from_mime(mime), stat
+
+
+def scan_directory(directory: str, extract_dir: str,
+                   mime_cache: MimeCache) -> Iterator[tuple[str, Optional[str], os.stat_result]]:
+    """
+    Yields paths of files in the directory with their suffix detected by magic and their stat
+    :param directory: directory or a single file
+    """
+    file_paths = iter_file_paths(directory, extract_dir)
+    while batch := list(islice(file_paths, config.MIME_DETECTION_BATCH)):
+        yield from detect_formats(batch, mime_cache)
+
+
+def is_supported(file_path: str, suffix: Optional[str]) -> bool:
+    # files without suffix can be detected by Tika, but unsupported formats are skipped
+    if not suffix:
+        logger.warning(f"{file_path} - unknown file format")
+    elif suffix not in config.SUPPORTED_FORMATS:
+        logger.warning(f"{file_path} skipped - unsupported file format: {suffix}")
+        return False
+    return True
+
+
+def make_file(file_abs_path: str, suffix: Optional[str], stat: os.stat_result) -> Optional[File]:
+    if not is_supported(file_abs_path, suffix):
+        return None
+
+    file = File(file_abs_path, suffix)
+    # size is used to estimate the cost of processing
+    file.size = stat.st_size
+    file.mtime = stat.st_mtime
+    # content is hashed only once the manifest decides that the file has to be processed
+    return file
+
+
+def walk_archive(archive_path: str) -> Iterator[File]:
+    """
+    Yields members of a zip or tar archive without extracting it, their paths look like archive.zip!/dir/file.pdf
+    :raises NotStreamableError: if the archive has to be extracted, e.g. it contains compressed archives
+    """
+    with open(archive_path, "rb") as fileobj:
+        with open_container(fileobj) as container:
+            # checked before any member is yielded, so the members aren't found again after the extraction
+            check_nested_archives(container)
+        fileobj.seek(0)
+        yield from walk_container(archive_path, fileobj)
+
+
+def check_nested_archives(container: Container):
+    """
+    Nested archives can be read directly only if they are zip or uncompressed tar archives stored uncompressed,
+    otherwise each read of their member would decompress them from the start
+    :raises NotStreamableError: if a nested archive has to be extracted
+    """
+    for name, _, _ in iter_members(container):
+        if not name.lower().endswith(archives_suffixes):
+            continue
+        if not name.lower().endswith(STREAMABLE_SUFFIXES) or not is_stored(container, name):
+            raise NotStreamableError(f"{name} has to be extracted")
+        with open_member(container, name) as member, open_container(member) as nested:
+            check_nested_archives(nested)
+
+
+def walk_container(archive_path: str, fileobj) -> Iterator[File]:
+    with open_container(fileobj) as container:
+        for name, size, mtime in iter_members(container):
+            path = member_path(archive_path, name)
+            with open_member(container, name) as member:
+                header = member.read(config.MAGIC_HEADER_SIZE)
+                suffix = extension_from_mime(get_buffer_format_magic(header, path))
+
+                if suffix in STREAMABLE_SUFFIXES:
+                    # nested archive
+                    try:
+                        if not is_stored(container, name):
+                            raise NotStreamableError("compressed nested archive")
+                        yield from walk_container(path, member)
+                    except NotStreamableError:
+                        logger.warning(f"{path} skipped - archive can't be read without extraction")
+                    continue
+                if not is_supported(path, suffix):
+                    continue
+
+                file = File(path, suffix)
+                file.size = size
+                file.mtime = mtime
+            yield file
+
+
+def walk_files(root_dir: str, paths: Optional[list[str]] = None, shared: bool = False) -> Iterator[File]:
+    """
+    Lazily yields all files reachable from given root directory including the contents of archives.
+    Zip and uncompressed tar archives are read directly when ARCHIVE_MODE is "stream", other archives are extracted
+    in worker processes while the scan continues and only their contents are scanned then.
     :param root_dir: relative or absolute path
-    :return: list of paths
+    :param paths: files and directories inside the root directory to scan instead of the whole root directory
+    :param shared: the root directory is crawled by several nodes over a network file system
+    :return: generator of files
     """
     if not os.path.isdir(root_dir):
         raise NotADirectoryError()
 
-    all_files: list[File] = []
-    # images need to be processed last because OCR is expensive
-    files_ocr: list[File] = []
-
-    # absolute path of current working directory
-    wd_abs = os.getcwd()
-
+    root_dir = os.path.abspath(root_dir)
     # directory to extract archives to
-    extract_dir_name = "_extracted_by_NERvana"
-    extract_dir = os.path.join(wd_abs, root_dir, extract_dir_name)
-    if not os.path.exists(extract_dir):
-        os.mkdir(extract_dir)
+    extract_dir = os.path.join(root_dir, EXTRACT_DIR_NAME)
+    os.makedirs(extract_dir, exist_ok=True)
 
-    # TODO: do subsequent checks only in the extract dir
-    # iteratively look for archives and extract them until there are no more archives
-    while True:
-        found_archive = False
-        for root_current, _, files in os.walk(root_dir):
-            for filename in files:
-                file_abs_path = os.path.join(wd_abs, root_current, filename)
-                magic_mimetype = get_file_format_magic(file_abs_path)
-                suffix = extension_from_mime(magic_mimetype)
+    directories = deque(os.path.abspath(path) for path in paths) if paths is not None else deque([root_dir])
+    archives: deque[tuple[str, str]] = deque()
+    extractions: dict[Future, tuple[str, str]] = {}
 
-                if suffix in archives_suffixes:
+    def start_extractions():
+        while archives and len(extractions) < config.ARCHIVE_WORKERS:
+            archive_path, target_dir = archives.popleft()
+            future = get_process_pool().submit(extract_archive, archive_path, target_dir)
+            extractions[future] = archive_path, target_dir
+
+    mime_cache = MimeCache(os.path.join(root_dir, config.MIME_CACHE_FILENAME), shared)
+    try:
+        while directories or archives or extractions:
+            if not directories:
+                done, _ = wait(extractions, return_when=FIRST_COMPLETED)
+                for future in done:
+                    archive_path, target_dir = extractions.pop(future)
                     try:
-                        extract_archive(file_abs_path, extract_dir)
-                        logger.info(f"Extracted {file_abs_path}")
-                        # remove archive after extraction
-                        os.remove(file_abs_path)
+                        future.result()
+                        logger.info(f"Extracted {archive_path}")
+                        directories.append(target_dir)
                     except Exception as e:
-                        logger.error(f"Could not extract {file_abs_path}: {e}")
+                        logger.error(f"Could not extract {archive_path}: {e}")
+                start_extractions()
+                continue
 
-                    found_archive = True
-        if not found_archive:
-            break
+            for file_abs_path, suffix, stat in scan_directory(directories.popleft(), extract_dir, mime_cache):
+                if suffix in archives_suffixes:
+                    if config.ARCHIVE_MODE == "stream" and suffix in STREAMABLE_SUFFIXES:
+                        try:
+                            yield from walk_archive(file_abs_path)
+                            continue
+                        except NotStreamableError:
+                            # e.g. compressed single file, extraction handles it
+                            pass
+                        except Exception as e:
+                            logger.error(f"Could not read {file_abs_path}: {e}")
+                            continue
+
+                    target_dir = get_extraction_dir(file_abs_path, root_dir, extract_dir)
+                    if os.path.isdir(target_dir):
+                        # extracted in a previous run
+                        directories.append(target_dir)
+                    else:
+                        archives.append((file_abs_path, target_dir))
+                        start_extractions()
+                    continue
+
+                file = make_file(file_abs_path, suffix, stat)
+                if file:
+                    yield file
+    finally:
+        mime_cache.close()
+
+
+def get_files(root_dir: str) -> list[File]:
+    """
+    Returns all absolute file paths reachable from given root directory
+    :param root_dir: relative or absolute path
+    :return: list of paths
+    """
+    return list(walk_files(root_dir))
 
-    for root_current, _, files in os.walk(root_dir):
-        for filename in files:
-            file_abs_path = os.path.join(wd_abs, root_current, filename)
-            magic_mimetype = get_file_format_magic(file_abs_path)
-            suffix = extension_from_mime(magic_mimetype)
-
-            # files without suffix can be detected by Tika, but unsupported formats are skipped
-            if not suffix:
-                logger.warning(f"{file_abs_path} - unknown file format")
-            elif suffix not in config.SUPPORTED_FORMATS:
-                logger.warning(f"{file_abs_path} skipped - unsupported file format: {suffix}")
-                continue
 
-            file = File(file_abs_path, suffix)
-            if suffix in config.OCR_FROMATS:
-                files_ocr.append(file)
-            else:
-                all_files.append(file)
+async def iter_files(root_dir: str, paths: Optional[list[str]] = None,
+                     shared: bool = False) -> AsyncIterator[File]:
+    """
+    Async version of walk_files, the blocking directory traversal runs in a separate thread
+    """
+    files = walk_files(root_dir, paths, shared)
+    while True:
+        file = await run_sync_fn_async_io(next, files, None, io_pool="filesystem")
+        if file is None:
+            break
+        yield file
 
-    # add files that need OCR to the end of the list
-    all_files.extend(files_ocr)
-    return all_files
@@ -1,12 +1,14 @@
 import math
+from typing import Optional
 
 import cv2
 import numpy as np
-import pytesseract
+from lingua import Language
 
 from config import config
 from config.config import SUPPORTED_LANGUAGES
-from utils import filter_for_lang_detection, setup_logger, generic_filter
+from utils import filter_for_lang_detection, setup_logger, generic_filter, metrics
+from . import tesseract
 from .metadata import determine_text_language
 
 logger = setup_logger(__name__)
@@ -43,58 +45,110 @@ def deskew_image(
     return cv2.warpAffine(image, rot_mat, (int(round(height)), int(round(width))), borderValue=background)
 
 
-def find_best_rotation(preprocessed_image):
+ANGLE_TO_CV2 = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE,
+}
+# text recognized in a rotation of the image: detection confidence, text, language, confidence of the language
+RotationScore = tuple[float, str, Language, float]
+
+
+def rotate(image: np.ndarray, angle: int) -> np.ndarray:
+    """
+    Rotate the image counterclockwise by a multiple of 90 degrees
+    """
+    return cv2.rotate(image, ANGLE_TO_CV2[angle]) if angle != 0 else image
+
+
+def score_rotation(image: np.ndarray) -> Optional[RotationScore]:
+    """
+    Recognize text with Tesseract and rate it by the average confidence of the words and of the detected language
+    :return: None if no text in a supported language was found
     """
-    Find the best among 4 possible rotations of the image based on the average confidence of the text recognition by Tessaract
+    data = tesseract.image_to_data(image)
+
+    confidences = []
+    text = ""
+    # Extract the detection confidences of current orientation but exclude empty, or non-alphanumeric text
+    for detected_text, conf in zip(data["text"], data["conf"]):
+        if not detected_text.isspace() and conf != -1:
+            confidences.append(conf)
+            text += detected_text + " "
+
+    if not confidences:
+        return None
+
+    detection_confidence = sum(confidences) / len(confidences)
+    text = generic_filter(text)
+    text = text.lower()
+
+    # filter out non-alphanumeric characters for language detection
+    filtered_text = filter_for_lang_detection(text)
+
+    lang, lang_confidence = determine_text_language(filtered_text)
+    if not lang or lang not in SUPPORTED_LANGUAGES:
+        return None
+
+    # calculate final confidence as the product of detection confidence and language confidence
+    return detection_confidence * lang_confidence, text, lang, lang_confidence
+
+
+def detect_orientation_osd(image: np.ndarray) -> Optional[int]:
+    """
+    Detect orientation with the orientation and script detection of Tesseract
+    :return: counterclockwise angle to rotate the image by, None if Tesseract isn't confident
+    """
+    orientation = tesseract.detect_orientation(image)
+    if orientation is None:
+        return None
+    angle, confidence = orientation
+    if confidence < config.ORIENTATION_OSD_MIN_CONFIDENCE:
+        return None
+    return angle
+
+
+def detect_orientation_thumbnail(image: np.ndarray) -> Optional[int]:
+    """
+    Detect orientation by recognizing text in all rotations of a downscaled image
+    :return: counterclockwise angle to rotate the image by, None if no text was found or the image is already small
+    """
+    scale = config.ORIENTATION_THUMBNAIL_SIZE / max(image.shape[:2])
+    if scale >= 1:
+        # searching all rotations of the image itself is as cheap
+        return None
+    image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    best_angle, best_confidence = None, -np.inf
+    for angle in [0, 90, 180, 270]:
+        score = score_rotation(rotate(image, angle))
+        if score and score[0] > best_confidence:
+            best_angle, best_confidence = angle, score[0]
+    return best_angle
+
+
+def find_best_rotation(preprocessed_image, scores: Optional[dict[int, Optional[RotationScore]]] = None):
+    """
+    Find the best among 4 possible rotations of the image based on the average confidence of the text recognition
+    by Tessaract
     :param preprocessed_image: image after preprocessing
+    :param scores: already computed scores of some rotations
     :return: rotated image, text returned by tesseract, language of the text, confidence of the language
     """
+    scores = scores or {}
     best_confidence = -np.inf
     best_rotation = preprocessed_image
     best_text = ""
     best_lang = None
     best_lang_confidence: float = 0
 
-    angle_to_cv2 = {
-        90: cv2.ROTATE_90_COUNTERCLOCKWISE,
-        180: cv2.ROTATE_180,
-        270: cv2.ROTATE_90_CLOCKWISE,
-    }
-
     for angle in [0, 90, 180, 270]:
-        rotated = cv2.rotate(preprocessed_image, angle_to_cv2[angle]) if angle != 0 else preprocessed_image
-
-        # Run Tesseract on the rotated image
-        # Extract the detection confidences of current orientation but exclude empty, or non-alphanumeric text
-        data = pytesseract.image_to_data(rotated, config=config.TESSERACT_CONFIG,
-                                         lang=config.TESSERACT_LANG_STRING,
-                                         output_type=pytesseract.Output.DICT)
-
-        confidences = []
-        text = ""
-        # Extract the detection confidences of current orientation but exclude empty, or non-alphanumeric text
-        for detected_text, conf in zip(data["text"], data["conf"]):
-            if not detected_text.isspace() and conf != -1:
-                confidences.append(conf)
-                text += detected_text + " "
-
-        if not confidences:
-            continue
-
-        detection_confidence = sum(confidences) / len(confidences)
-        text = generic_filter(text)
-        text = text.lower()
-
-        # filter out non-alphanumeric characters for language detection
-        filtered_text = filter_for_lang_detection(text)
-
-        lang, lang_confidence = determine_text_language(filtered_text)
-        if not lang or lang not in SUPPORTED_LANGUAGES:
+        rotated = rotate(preprocessed_image, angle)
+        score = scores[angle] if angle in scores else score_rotation(rotated)
+        if not score:
             continue
 
-        # calculate final confidence as the product of detection confidence and language confidence
-        detection_confidence *= lang_confidence
-
+        detection_confidence, text, lang, lang_confidence = score
         if angle == 0:
             # give a bit more weight to unrotated image
             detection_confidence *= 1.1
@@ -112,15 +166,55 @@ def find_best_rotation(preprocessed_image):
     return best_rotation, best_text, best_lang, best_lang_confidence
 
 
-def preprocess_ocr(image: np.ndarray):
+def detect_orientation(image: np.ndarray) -> Optional[int]:
+    if config.ORIENTATION_DETECTION == "osd":
+        return detect_orientation_osd(image)
+    if config.ORIENTATION_DETECTION == "thumbnail":
+        return detect_orientation_thumbnail(image)
+    return None
+
+
+def prepare_image(image: np.ndarray) -> tuple[np.ndarray, Optional[int]]:
     """
-    Preprocess the image for OCR
+    Convert the image to grayscale and detect its orientation
     :param image: image opened with opencv
-    :return: preprocessed image, tesseract text, language of tesseract text, confidence of the language
+    :return: grayscale image, counterclockwise angle to rotate it by or None if unknown
     """
     gray = grayscale(image)
+    return gray, detect_orientation(gray)
+
+
+def run_tesseract_ocr(gray: np.ndarray, angle: Optional[int]):
+    """
+    Recognize text of the image with Tesseract
+    :param gray: grayscale image
+    :param angle: detected orientation, if it's unknown or the text isn't confident all rotations are tried
+    :return: rotated image, tesseract text, language of tesseract text, confidence of the language
+    """
+    # full OCR runs once on the detected orientation
+    if angle is not None:
+        rotated = rotate(gray, angle)
+        score = score_rotation(rotated)
+        if score and score[3] >= config.ORIENTATION_MIN_CONFIDENCE:
+            metrics.inc("orientation_detection_total", result="detected")
+            _, tesseract_text, tesseract_lang, tesseract_prob = score
+            return rotated, tesseract_text, tesseract_lang, tesseract_prob
+        metrics.inc("orientation_detection_total", result="fallback")
+        scores = {angle: score}
+    else:
+        scores = {}
 
     # find the most confident orientation
-    rotated, tesseract_text, tesseract_lang, tesseract_prob = find_best_rotation(gray)
+    rotated, tesseract_text, tesseract_lang, tesseract_prob = find_best_rotation(gray, scores)
 
     return rotated, tesseract_text, tesseract_lang, tesseract_prob
+
+
+def preprocess_ocr(image: np.ndarray):
+    """
+    Preprocess the image for OCR
+    :param image: image opened with opencv
+    :return: preprocessed image, tesseract text, language of tesseract text, confidence of the language
+    """
+    gray, angle = prepare_image(image)
+    return run_tesseract_ocr(gray, angle)
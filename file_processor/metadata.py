@@ -1,10 +1,16 @@
+import hashlib
 import mimetypes
+import threading
 
 import magic
 from lingua import LanguageDetectorBuilder, Language
 
-# magic object
-pymagic = magic.Magic(mime=True)
+from config import config
+from utils import metrics
+from .archives import open_path
+
+# libmagic handles mustn't be shared between threads
+_magic_local = threading.local()
 # language detector
 lang_detector = LanguageDetectorBuilder.from_all_spoken_languages().build()
 
@@ -21,8 +27,7 @@ def extension_from_mime(mime_type: str | None) -> str | None:
     return mimetypes.guess_extension(mime_type)
 
 
-def get_file_format_magic(file_path) -> str:
-    mime = pymagic.from_file(file_path)
+def normalize_magic_mime(mime: str, file_path: str) -> str:
     if mime == "text/rtf":
         mime = "application/rtf"
     if mime == "application/vnd.ms-office" and file_path.endswith(".anb"):
@@ -30,8 +35,34 @@ def get_file_format_magic(file_path) -> str:
     return mime
 
 
+def get_magic() -> magic.Magic:
+    if not hasattr(_magic_local, "magic"):
+        _magic_local.magic = magic.Magic(mime=True)
+    return _magic_local.magic
+
+
+def get_file_format_magic(file_path) -> str:
+    # only the beginning of the file is needed
+    with open(file_path, "rb") as f:
+        header = f.read(config.MAGIC_HEADER_SIZE)
+    return get_buffer_format_magic(header, file_path)
+
+
+def get_buffer_format_magic(buffer: bytes, file_path: str) -> str:
+    """
+    Detect format from the beginning of the file
+    """
+    return normalize_magic_mime(get_magic().from_buffer(buffer), file_path)
+
+
+def get_file_hash(file_path) -> str:
+    with open_path(file_path) as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
 def determine_text_language(text: str) -> tuple[Language | None, float]:
-    languages = lang_detector.compute_language_confidence_values(text)
+    with metrics.timer("language_detection_seconds"):
+        languages = lang_detector.compute_language_confidence_values(text)
     if not languages or languages[0].value < 0.6:
         # no reliable language detection
         return None, 0
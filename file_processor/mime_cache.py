@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+
+class MimeCache:
+    """
+    Persistent cache of MIME types detected by magic stored in SQLite in the root directory.
+    Files are identified by device and inode, the entry is valid while their size and modification time match.
+    """
+
+    def __init__(self, db_path: str, shared: bool = False):
+        # the crawler runs in several threads of the filesystem pool
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        # WAL mode doesn't work when the cache is shared by nodes over a network file system
+        self.conn.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mime (
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                mime TEXT NOT NULL,
+                PRIMARY KEY (dev, ino)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get(self, stat: os.stat_result) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mime FROM mime WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items: list[tuple[os.stat_result, str]]):
+        if not items:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO mime (dev, ino, size, mtime_ns, mime) VALUES (?, ?, ?, ?, ?)",
+                [(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, mime) for stat, mime in items],
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,15 +1,27 @@
+import asyncio
+import time
+from collections import OrderedDict
 from typing import Optional
 
 import cv2
 import easyocr
 import numpy as np
 from lingua import Language
-from pytesseract import pytesseract
 
 from config import config
-from file_processor.image_preprocessor import preprocess_ocr
+from file_processor.image_preprocessor import prepare_image, run_tesseract_ocr
 from file_processor.metadata import determine_text_language
-from utils import filter_for_lang_detection, setup_logger, run_sync_fn_async_cpu, generic_filter
+from utils import (
+    filter_for_lang_detection,
+    setup_logger,
+    run_sync_fn_async_cpu,
+    run_sync_fn_async_io,
+    generic_filter,
+    metrics,
+)
+from . import tesseract
+from .archives import open_path
+from .ocr_batcher import EasyOCRBatcher
 from .tika_client import call_tika_ocr
 
 logger = setup_logger(__name__)
@@ -99,15 +111,49 @@ available_easyocr_languages = ["abq",
 
 
 async def run_tesseract(preprocessed_image):
-    text = await run_sync_fn_async_cpu(pytesseract.image_to_string, preprocessed_image, config=config.TESSERACT_CONFIG,
-                                       lang=config.TESSERACT_LANG_STRING)
+    text = await run_sync_fn_async_cpu(tesseract.image_to_string, preprocessed_image)
     text = generic_filter(text)
     text = text.lower()
     filtered_text = filter_for_lang_detection(text)
     return text, filtered_text
 
 
-def run_easyocr(preprocessed_image, detected_lang: Language | None):
+# readers of this process by their languages, the least recently used is dropped first
+_easyocr_readers: OrderedDict[tuple[str, ...], easyocr.Reader] = OrderedDict()
+
+
+def get_easyocr_reader(langs: tuple[str, ...]) -> easyocr.Reader:
+    """
+    Reader for given languages, loaded models are kept for next images processed by this process
+    """
+    if langs in _easyocr_readers:
+        metrics.inc("easyocr_reader_cache_total", result="hit")
+        _easyocr_readers.move_to_end(langs)
+        return _easyocr_readers[langs]
+
+    metrics.inc("easyocr_reader_cache_total", result="miss")
+    start = time.perf_counter()
+    reader = easyocr.Reader(list(langs), gpu=config.GPU, model_storage_directory=config.EASYOCR_MODELS_DIR,
+                            download_enabled=False)
+    metrics.observe("easyocr_reader_load_seconds", time.perf_counter() - start)
+
+    _easyocr_readers[langs] = reader
+    while len(_easyocr_readers) > config.EASYOCR_READER_CACHE_SIZE:
+        _easyocr_readers.popitem(last=False)
+    return reader
+
+
+def warm_up():
+    """
+    Load OCR models so the first image processed by this process doesn't wait for them
+    """
+    get_easyocr_reader(tuple(config.EASYOCR_DEFAULT_LANGS))
+    tesseract.warm_up()
+    # language models of the detector are loaded lazily
+    determine_text_language("warm up language detection")
+
+
+def easyocr_langs(detected_lang: Language | None) -> tuple[str, ...]:
     if (detected_lang and detected_lang in config.SUPPORTED_LANGUAGES and
             detected_lang.iso_code_639_1.name.lower() in available_easyocr_languages):
         easyocr_langs = [detected_lang.iso_code_639_1.name.lower()]
@@ -116,15 +162,39 @@ def run_easyocr(preprocessed_image, detected_lang: Language | None):
             easyocr_langs.append("en")
     else:
         easyocr_langs = config.EASYOCR_DEFAULT_LANGS
-    reader = easyocr.Reader(easyocr_langs, gpu=config.GPU, model_storage_directory=config.EASYOCR_MODELS_DIR,
-                            download_enabled=False)
-    data = reader.readtext(preprocessed_image, detail=0)
-    text = " ".join(data)
-    text = generic_filter(text)
-    text = text.lower()
-    filtered_text = filter_for_lang_detection(text)
+    return tuple(easyocr_langs)
+
+
+def run_easyocr_batch(images: list[np.ndarray], langs: tuple[str, ...],
+                      find_rotation: bool) -> list[tuple[str, Optional[Language], float]]:
+    """
+    Recognize text of images of the same size with EasyOCR in one batch
+    :return: text, its language and confidence of the language for each image
+    """
+    reader = get_easyocr_reader(langs)
+    # other rotations are tried when the orientation is unknown
+    rotation_info = [90, 180, 270] if find_rotation else None
+    # the detector processes all images at once, the recognizer the found text boxes in batches of the same size
+    with metrics.timer("ocr_seconds", engine="easyocr"):
+        batch_data = reader.readtext_batched(images, detail=0, rotation_info=rotation_info,
+                                             batch_size=config.EASYOCR_BATCH_SIZE)
+
+    results = []
+    for data in batch_data:
+        text = " ".join(data)
+        text = generic_filter(text)
+        text = text.lower()
+        filtered_text = filter_for_lang_detection(text)
+
+        lang, prob = determine_text_language(filtered_text)
+        if not lang or lang not in config.SUPPORTED_LANGUAGES:
+            results.append((text, None, 0))
+        else:
+            results.append((text, lang, prob))
+    return results
 
-    return text, filtered_text
+
+easyocr_batcher = EasyOCRBatcher(run_easyocr_batch, config.EASYOCR_BATCH_SIZE, config.EASYOCR_BATCH_MAX_LATENCY)
 
 
 def determine_better_model(tess_prob: float, easyocr_prob: float) -> str | None:
@@ -158,36 +228,70 @@ def tika_ocr(file_path: str) -> tuple[Optional[str], Optional[Language]]:
     return text, lang
 
 
-def run_ocr(file_path: str) -> tuple[Optional[str], Optional[Language]]:
+def load_image(file_path: str) -> tuple[np.ndarray, Optional[int]]:
+    """
+    Decode the image, convert it to grayscale and detect its orientation
+    """
+    # handle images with non ascii paths and images inside archives
+    with open_path(file_path) as image_file:
+        image = cv2.imdecode(np.frombuffer(image_file.read(), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    return prepare_image(image)
+
+
+def tesseract_ocr(gray: np.ndarray, angle: Optional[int]):
+    with metrics.timer("ocr_seconds", engine="tesseract"):
+        return run_tesseract_ocr(gray, angle)
+
+
+async def easyocr_ocr(image: np.ndarray, detected_lang: Optional[Language],
+                      find_rotation: bool = False) -> tuple[str, Optional[Language], float]:
+    """
+    Recognize text with EasyOCR together with images of other files in the same languages
+    :return: text, its language and confidence of the language
+    """
+    try:
+        return await easyocr_batcher.recognize(image, easyocr_langs(detected_lang), find_rotation)
+    except Exception as e:
+        logger.error(f"EasyOCR failed with exception: {e}")
+        return "", None, 0
+
+
+async def run_ocr(file_path: str) -> tuple[Optional[str], Optional[Language]]:
     """
     Perform OCR on the given file and return the text and language.
+    EasyOCR runs only if the text recognized by Tesseract isn't confident enough. If the orientation of the image
+    is unknown, both engines run at the same time in separate worker processes.
     """
     try:
-        # handle images with non ascii paths
-        image = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
-        logger.info(f"File({file_path}): Running Tessaract preprocessing")
-        # preprocess the image and detect orientation with tesseract ocr
-        image_preprocessed, tesseract_text, tesseract_lang, tesseract_prob = preprocess_ocr(image)
-
-        logger.info(f"File({file_path}): Running EasyOCR")
-
-        try:
-            easyocr_text, easyocr_filtered = run_easyocr(image_preprocessed, tesseract_lang)
-        except Exception as e:
-            logger.error(f"File({file_path}): EasyOCR failed with exception: {e}")
-            easyocr_text = ""
-            easyocr_filtered = ""
-
-        easyocr_lang, easyocr_prob = determine_text_language(easyocr_filtered)
-        if not easyocr_lang or easyocr_lang not in config.SUPPORTED_LANGUAGES:
-            easyocr_lang = None
-            easyocr_prob = 0
+        gray, angle = await run_sync_fn_async_cpu(load_image, file_path)
+        if angle is not None:
+            logger.info(f"File({file_path}): Running Tesseract")
+            rotated, tesseract_text, tesseract_lang, tesseract_prob = await run_sync_fn_async_cpu(
+                tesseract_ocr, gray, angle
+            )
+            if tesseract_prob >= config.OCR_EARLY_EXIT_CONFIDENCE:
+                metrics.inc("ocr_early_exit_total")
+                metrics.inc("ocr_engine_wins_total", engine="tesseract")
+                return tesseract_text, tesseract_lang
+
+            logger.info(f"File({file_path}): Running EasyOCR")
+            easyocr_text, easyocr_lang, easyocr_prob = await easyocr_ocr(rotated, tesseract_lang)
+        else:
+            logger.info(f"File({file_path}): Running Tesseract and EasyOCR")
+            # EasyOCR finds the rotation itself
+            (_, tesseract_text, tesseract_lang, tesseract_prob), (easyocr_text, easyocr_lang, easyocr_prob) = \
+                await asyncio.gather(
+                    run_sync_fn_async_cpu(tesseract_ocr, gray, None),
+                    easyocr_ocr(gray, None, True),
+                )
 
         better_model = determine_better_model(tesseract_prob, easyocr_prob)
+        metrics.inc("ocr_engine_wins_total", engine=better_model or "tika")
         if not better_model:
             # all models failed to obtained meaningful text
             logger.warning(f"File({file_path}): OCR failed to obtain meaningful text using Tika as fallback")
-            return tika_ocr(file_path)
+            with metrics.timer("ocr_seconds", engine="tika"):
+                return await run_sync_fn_async_io(tika_ocr, file_path)
 
         text = easyocr_text if better_model == "easyocr" else tesseract_text
         lang = easyocr_lang if better_model == "easyocr" else tesseract_lang
@@ -0,0 +1,95 @@
+import asyncio
+import math
+from typing import Any, Callable, Hashable
+
+import cv2
+import numpy as np
+
+from utils import setup_logger, run_sync_fn_async_cpu, metrics
+
+logger = setup_logger(__name__)
+
+
+def size_class(image: np.ndarray) -> tuple[int, int]:
+    # images in a batch are padded to the same size, so only images of similar size are batched together
+    height, width = image.shape[:2]
+    return math.ceil(math.log2(max(height, 1))), math.ceil(math.log2(max(width, 1)))
+
+
+def pad_images(images: list[np.ndarray]) -> list[np.ndarray]:
+    """
+    Pad images with white background to the size of the largest one
+    """
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    return [
+        cv2.copyMakeBorder(image, 0, height - image.shape[0], 0, width - image.shape[1], cv2.BORDER_CONSTANT,
+                           value=255)
+        for image in images
+    ]
+
+
+class EasyOCRBatcher:
+    """
+    Collects images of multiple files recognized with the same languages and runs them through EasyOCR together
+    in one worker process. A batch is sent once it has batch_size images or its first image waited for max_latency
+    seconds, so single files are not held back.
+    """
+
+    def __init__(self, recognize_batch: Callable[..., list], batch_size: int, max_latency: float):
+        """
+        :param recognize_batch: function run in a worker process with the images and the key of the batch
+        """
+        self.recognize_batch = recognize_batch
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.pending: dict[Hashable, list[tuple[np.ndarray, asyncio.Future]]] = {}
+        self.timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    async def recognize(self, image: np.ndarray, *key: Hashable) -> Any:
+        """
+        Result of recognize_batch for the image, images with the same key are batched together
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch_key = (*key, size_class(image))
+        batch = self.pending.setdefault(batch_key, [])
+        batch.append((image, future))
+
+        if len(batch) >= self.batch_size:
+            self.flush(batch_key)
+        elif len(batch) == 1:
+            self.timers[batch_key] = loop.call_later(self.max_latency, self.flush, batch_key)
+        return await future
+
+    def flush(self, batch_key: Hashable):
+        timer = self.timers.pop(batch_key, None)
+        if timer:
+            timer.cancel()
+        batch = self.pending.pop(batch_key, None)
+        if not batch:
+            return
+        task = asyncio.create_task(self.run_batch(batch_key, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, batch_key: tuple, batch: list[tuple[np.ndarray, asyncio.Future]]):
+        # files whose processing was cancelled meanwhile are left out
+        batch = [(image, future) for image, future in batch if not future.done()]
+        if not batch:
+            return
+        metrics.observe("easyocr_batch_size", len(batch))
+        try:
+            images = pad_images([image for image, _ in batch])
+            results = await run_sync_fn_async_cpu(self.recognize_batch, images, *batch_key[:-1])
+        except Exception as e:
+            logger.error(f"EasyOCR batch of {len(batch)} images failed with exception: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,112 @@
+from functools import lru_cache
+from typing import Optional
+
+import cv2
+import numpy as np
+import pytesseract
+
+from config import config
+from utils import setup_logger
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = setup_logger(__name__)
+
+# Tesseract instances of this process, initialized on first use
+_api: Optional["tesserocr.PyTessBaseAPI"] = None
+_osd_api: Optional["tesserocr.PyTessBaseAPI"] = None
+
+
+@lru_cache(maxsize=None)
+def use_tesserocr() -> bool:
+    if config.TESSERACT_BACKEND != "tesserocr":
+        return False
+    if tesserocr is None:
+        logger.warning("tesserocr is not installed, using pytesseract")
+        return False
+    return True
+
+
+def get_api() -> "tesserocr.PyTessBaseAPI":
+    """
+    Tesseract kept in memory, so the language models are loaded only once per process
+    """
+    global _api
+    if _api is None:
+        _api = tesserocr.PyTessBaseAPI(lang=config.TESSERACT_LANG_STRING, psm=config.TESSERACT_PSM,
+                                       oem=config.TESSERACT_OEM)
+    return _api
+
+
+def get_osd_api() -> "tesserocr.PyTessBaseAPI":
+    global _osd_api
+    if _osd_api is None:
+        _osd_api = tesserocr.PyTessBaseAPI(lang="osd", psm=tesserocr.PSM.OSD_ONLY)
+    return _osd_api
+
+
+def set_image(api: "tesserocr.PyTessBaseAPI", image: np.ndarray):
+    # image buffer is passed directly instead of being written to a temporary file
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    image = np.ascontiguousarray(image)
+    height, width = image.shape[:2]
+    bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+    api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, bytes_per_pixel * width)
+
+
+def warm_up():
+    if use_tesserocr():
+        get_api()
+    else:
+        pytesseract.get_tesseract_version()
+
+
+def image_to_data(image: np.ndarray) -> dict[str, list]:
+    """
+    Recognized words and their confidences, -1 for words without confidence
+    """
+    if use_tesserocr():
+        api = get_api()
+        set_image(api, image)
+        words = api.MapWordConfidences()
+        return {"text": [word for word, _ in words], "conf": [conf for _, conf in words]}
+
+    data = pytesseract.image_to_data(image, config=config.TESSERACT_CONFIG, lang=config.TESSERACT_LANG_STRING,
+                                     output_type=pytesseract.Output.DICT)
+    return {"text": data["text"], "conf": data["conf"]}
+
+
+def image_to_string(image: np.ndarray) -> str:
+    if use_tesserocr():
+        api = get_api()
+        set_image(api, image)
+        return api.GetUTF8Text()
+    return pytesseract.image_to_string(image, config=config.TESSERACT_CONFIG, lang=config.TESSERACT_LANG_STRING)
+
+
+def detect_orientation(image: np.ndarray) -> Optional[tuple[int, float]]:
+    """
+    Detect orientation of the text with the orientation and script detection
+    :return: counterclockwise angle to rotate the image by and confidence, None if it can't be detected
+    """
+    if use_tesserocr():
+        api = get_osd_api()
+        set_image(api, image)
+        osd = api.DetectOrientationScript()
+        if not osd:
+            return None
+        # orientation is counterclockwise, so is the correction
+        return osd["orient_deg"], osd["orient_conf"]
+
+    try:
+        osd = pytesseract.image_to_osd(image, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractError as e:
+        # e.g. too few characters
+        logger.debug(f"Orientation detection failed: {e}")
+        return None
+    # Tesseract reports the clockwise rotation
+    return (360 - osd["rotate"]) % 360, osd["orientation_conf"]
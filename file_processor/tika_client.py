@@ -1,53 +1,257 @@
-import tika
-from requests import ReadTimeout, ConnectionError
-from tika import parser
+import asyncio
+import os
+import random
+from contextlib import contextmanager
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
 
-from utils import run_sync_fn_async_io, exponential_backoff_async
+import httpx
+
+from config import config
+from utils import (
+    setup_logger,
+    run_sync_fn_async_io,
+    exponential_backoff_async,
+    metrics,
+    get_limiter,
+    get_circuit_breaker,
+)
 from utils.exceptions import TikaError
+from .archives import open_path, stat_path
+
+logger = setup_logger(__name__)
+
+
+class TikaServer:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        metrics.gauge("tika_server_healthy", lambda: int(self.healthy), server=url)
+        metrics.gauge("tika_server_outstanding_requests", lambda: self.outstanding, server=url)
+
+    @contextmanager
+    def request(self):
+        self.outstanding += 1
+        try:
+            yield
+        except httpx.TransportError:
+            self.failures += 1
+            if self.failures >= config.TIKA_EJECT_FAILURES:
+                self.eject()
+            raise
+        else:
+            self.failures = 0
+        finally:
+            self.outstanding -= 1
+
+    def eject(self):
+        if self.healthy:
+            logger.warning(f"Tika server {self.url} is unavailable, not sending files to it")
+            metrics.inc("tika_server_ejections_total", server=self.url)
+        self.healthy = False
+
+    def readmit(self):
+        if not self.healthy:
+            logger.info(f"Tika server {self.url} is available again")
+        self.healthy = True
+        self.failures = 0
+
+
+class TikaPool:
+    """
+    Balances requests between Tika servers, each file goes to the healthy server with the least outstanding requests.
+    Unavailable servers are ejected and re-admitted once they pass a health check.
+    """
+
+    def __init__(self, urls: list[str]):
+        self.servers = [TikaServer(url) for url in urls]
+        self.health_task: Optional[asyncio.Task] = None
+
+    def choose(self) -> TikaServer:
+        healthy = [server for server in self.servers if server.healthy]
+        if not healthy and self.health_task is None:
+            # without health checks (in worker processes) all servers are tried again
+            for server in self.servers:
+                server.readmit()
+            healthy = self.servers
+        if not healthy:
+            # counts as a failure of Tika so the circuit breaker opens
+            raise httpx.ConnectError("No Tika server is available")
+        least_outstanding = min(server.outstanding for server in healthy)
+        return random.choice([server for server in healthy if server.outstanding == least_outstanding])
+
+    def start_health_checks(self):
+        if self.health_task is None:
+            self.health_task = asyncio.create_task(self.run_health_checks())
+
+    async def run_health_checks(self):
+        while True:
+            await asyncio.sleep(config.TIKA_HEALTH_CHECK_SECONDS)
+            await asyncio.gather(*(self.check_health(server) for server in self.servers))
+
+    async def check_health(self, server: TikaServer):
+        try:
+            response = await get_async_client().get(f"{server.url}/tika", timeout=config.TIKA_HEALTH_CHECK_TIMEOUT)
+            healthy = response.status_code == 200
+        except httpx.TransportError:
+            healthy = False
+
+        if healthy:
+            server.readmit()
+        else:
+            server.eject()
+
+    async def stop_health_checks(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            await asyncio.gather(self.health_task, return_exceptions=True)
+            self.health_task = None
+
+
+_tika_pool: Optional[TikaPool] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+
+
+def get_tika_urls() -> list[str]:
+    # comma separated list of servers, single server is supported for backwards compatibility
+    endpoints = os.environ.get("TIKA_SERVER_ENDPOINTS") or os.environ.get("TIKA_SERVER_ENDPOINT")
+    if not endpoints:
+        endpoints = "http://localhost:9998"
+    return [endpoint.strip().rstrip("/") for endpoint in endpoints.split(",") if endpoint.strip()]
 
-tika.TikaClientOnly = True
 
+def get_tika_pool() -> TikaPool:
+    global _tika_pool
+    if _tika_pool is None:
+        _tika_pool = TikaPool(get_tika_urls())
+    return _tika_pool
 
-async def call_tika_async(file_path: str, service: str):
-    request_options = {'timeout': 180}
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Client shared by all requests so connections to Tika are kept alive and reused
+    """
+    global _async_client
+    if _async_client is None:
+        max_requests = config.BACKEND_CONCURRENCY["tika"]["max_requests"] * len(get_tika_pool().servers)
+        limits = httpx.Limits(max_connections=max_requests, max_keepalive_connections=max_requests)
+        _async_client = httpx.AsyncClient(timeout=config.TIKA_TIMEOUT, limits=limits)
+    return _async_client
+
+
+async def close_tika_client():
+    global _async_client
+    if _tika_pool is not None:
+        await _tika_pool.stop_health_checks()
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def upload_headers(file_path: str, size: int, accept: str) -> dict[str, str]:
+    return {
+        "Accept": accept,
+        "Content-Length": str(size),
+        # Tika uses the filename as a hint for format detection
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(os.path.basename(file_path))}",
+    }
+
+
+async def read_chunks(file_path: str) -> AsyncIterator[bytes]:
+    """
+    Read the file in chunks so it's never held in memory as a whole, archive members are read from the archive.
+    Reads run in their own pool, so slow uploads don't hold up the crawler and hashing
+    """
+    opened = open_path(file_path)
+    file = await run_sync_fn_async_io(opened.__enter__, io_pool="tika")
+    try:
+        while chunk := await run_sync_fn_async_io(file.read, config.TIKA_UPLOAD_CHUNK_SIZE, io_pool="tika"):
+            yield chunk
+    finally:
+        await run_sync_fn_async_io(opened.__exit__, None, None, None, io_pool="tika")
+
+
+def parse_rmeta(entries: list[dict]) -> dict:
+    """
+    First entry holds metadata of the file, the others belong to embedded documents (e.g. email attachments)
+    """
+    metadata = {key: value for key, value in entries[0].items() if key != "X-TIKA:content"} if entries else {}
+    content = "\n".join(entry["X-TIKA:content"] for entry in entries if entry.get("X-TIKA:content"))
+    return {"metadata": metadata, "content": content}
+
+
+async def call_tika_async(file_path: str, size: int, with_text: bool = True) -> dict:
+    """
+    Get metadata and plaintext of the file in a single request
+    :param size: size of the file in bytes
+    :param with_text: if False, only metadata are extracted so Tika doesn't run its own OCR on images
+    """
+    service = "rmeta" if with_text else "meta"
+    path = "/rmeta/text" if with_text else "/meta"
+    tika_pool = get_tika_pool()
+    tika_pool.start_health_checks()
 
     async def analyze_file():
-        return await run_sync_fn_async_io(parser.from_file, file_path, service=service,
-                                          requestOptions=request_options)
+        # a retry may go to another server
+        server = tika_pool.choose()
+        with server.request():
+            async with get_limiter("tika", server.url).slot(size, [httpx.TransportError]) as slot:
+                with metrics.timer("tika_request_seconds", service=service):
+                    response = await get_async_client().put(
+                        f"{server.url}{path}",
+                        content=read_chunks(file_path),
+                        headers=upload_headers(file_path, size, "application/json"),
+                    )
+                slot.check_status(response.status_code)
+        return response
 
     try:
-        file_data = await exponential_backoff_async(
+        response = await exponential_backoff_async(
             analyze_file,
-            retry_exceptions=[ReadTimeout, ConnectionError],
+            retry_exceptions=[httpx.TransportError],
+            breaker=get_circuit_breaker("tika"),
         )
-        if file_data["status"] != 200:
-            raise TikaError(f"Tika returned {file_data['status']} code")
-
-        return file_data
-
-    except ReadTimeout:
+    except httpx.TimeoutException:
         raise TikaError(f"Tika timed out")
-    except ConnectionError:
+    except httpx.TransportError:
         raise TikaError(f"Cannot connect to Tika")
-    except RuntimeError:
-        raise TikaError(f"Unknown error")
-
 
-# sync version of call_tika_async for ocr without retries
-def call_tika_ocr(file_path: str):
-    request_options = {'timeout': 180}
+    if response.status_code != 200:
+        raise TikaError(f"Tika returned {response.status_code} code")
     try:
-        file_data = parser.from_file(file_path, service="text",
-                                     requestOptions=request_options)
+        data = response.json()
+    except ValueError:
+        raise TikaError(f"Tika returned invalid response")
+
+    if with_text:
+        return parse_rmeta(data)
+    return {"metadata": data, "content": None}
 
-        if file_data["status"] != 200:
-            raise TikaError(f"Tika returned {file_data['status']} code")
 
-        return file_data
+# sync version of call_tika_async for ocr without retries
+def call_tika_ocr(file_path: str) -> dict:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = httpx.Client(timeout=config.TIKA_TIMEOUT)
 
-    except ReadTimeout:
+    try:
+        server = get_tika_pool().choose()
+        size, _ = stat_path(file_path)
+        with server.request(), metrics.timer("tika_request_seconds", service="ocr"):
+            with open_path(file_path) as file:
+                response = _sync_client.put(
+                    f"{server.url}/tika",
+                    content=iter(lambda: file.read(config.TIKA_UPLOAD_CHUNK_SIZE), b""),
+                    headers=upload_headers(file_path, size, "text/plain"),
+                )
+    except httpx.TimeoutException:
         raise TikaError(f"Tika timed out")
-    except ConnectionError:
+    except httpx.TransportError:
         raise TikaError(f"Cannot connect to Tika")
-    except RuntimeError:
-        raise TikaError(f"Unknown error")
+
+    if response.status_code != 200:
+        raise TikaError(f"Tika returned {response.status_code} code")
+    return {"metadata": {}, "content": response.text}
@@ -0,0 +1,147 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import time
+from typing import AsyncIterator
+
+from config import config
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+class Watcher:
+    """
+    Watches the directory tree for new or modified files using inotify.
+    A path is reported once no events arrived for it for the debounce interval, so partially written files are skipped.
+    """
+
+    def __init__(self, root_dir: str, ignored_dirs: tuple[str, ...] = (), ignored_prefixes: tuple[str, ...] = ()):
+        self.root_dir = os.path.abspath(root_dir)
+        self.ignored_dirs = ignored_dirs
+        self.ignored_prefixes = ignored_prefixes
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches: dict[int, str] = {}
+        # paths with events and the time of their last event
+        self.pending: dict[str, float] = {}
+        self.stopped = False
+        self.add_watches(self.root_dir)
+        asyncio.get_running_loop().add_reader(self.fd, self.read_events)
+
+    def stop(self):
+        # changes ends at its next check, paths still waiting for the debounce interval are not reported
+        self.stopped = True
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+    def is_ignored(self, path: str) -> bool:
+        return (
+            any(path == ignored or path.startswith(ignored + os.sep) for ignored in self.ignored_dirs)
+            or os.path.basename(path).startswith(self.ignored_prefixes)
+        )
+
+    def add_watches(self, directory: str):
+        for root_current, dirs, _ in os.walk(directory):
+            dirs[:] = [dirname for dirname in dirs if not self.is_ignored(os.path.join(root_current, dirname))]
+            wd = _libc.inotify_add_watch(self.fd, os.fsencode(root_current), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                logger.warning(f"Cannot watch {root_current}: {os.strerror(errno)}")
+                continue
+            self.watches[wd] = root_current
+
+    def read_events(self):
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        now = time.monotonic()
+        while offset < len(buffer):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, the whole tree is scanned again
+                logger.warning("Too many filesystem events, rescanning the whole directory")
+                self.pending[self.root_dir] = now
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+            if self.is_ignored(path):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files created before the watch was added are found by scanning the directory
+                    self.add_watches(path)
+                    self.pending[path] = now
+                continue
+            self.pending[path] = now
+
+    def defer(self, path: str):
+        # reported again after the debounce interval
+        self.pending[path] = time.monotonic()
+
+    def pop_ready(self) -> list[str]:
+        """
+        Paths without events for the debounce interval, files inside reported directories are left out
+        """
+        now = time.monotonic()
+        waiting = [
+            path for path, last_event in self.pending.items() if now - last_event < config.WATCH_DEBOUNCE_SECONDS
+        ]
+        ready = [
+            path for path, last_event in self.pending.items()
+            if now - last_event >= config.WATCH_DEBOUNCE_SECONDS
+            # directory is scanned once all files in it are written
+            and not any(waiting_path.startswith(path + os.sep) for waiting_path in waiting)
+        ]
+        for path in ready:
+            del self.pending[path]
+        directories = {path for path in ready if os.path.isdir(path)}
+        return [
+            path for path in ready
+            if not any(path != directory and path.startswith(directory + os.sep) for directory in directories)
+        ]
+
+    async def changes(self) -> AsyncIterator[list[str]]:
+        """
+        Yields batches of new or modified files and directories until stopped
+        """
+        while not self.stopped:
+            await asyncio.sleep(config.WATCH_DEBOUNCE_SECONDS / 2)
+            if self.stopped:
+                return
+            ready = self.pop_ready()
+            if ready:
+                yield ready
@@ -0,0 +1,5 @@
+from .manager import Pipeline
+from .manifest import Manifest
+from .stage import Stage
+from .work_queue import WorkQueue
+from .service import JobService
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+from file_processor import File
+
+
+class DuplicateRegistry:
+    """
+    Keeps track of files with identical content, so only the first of them (the original) is processed
+    and its duplicates reuse the extracted plaintext and entities
+    """
+
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        # content hash -> duplicates waiting for the original which is being processed
+        self.in_progress: dict[str, list[File]] = {}
+        # content hash -> processed original, the least recently used are evicted
+        self.processed: OrderedDict[str, File] = OrderedDict()
+
+    def find_original(self, file: File) -> File | None:
+        original = self.processed.get(file.content_hash)
+        if original is not None:
+            self.processed.move_to_end(file.content_hash)
+        return original
+
+    def claim(self, file: File) -> bool:
+        """
+        Register the file as the original of its content
+        :return: False if another file with the same content is being processed, the file waits for it
+        """
+        if file.content_hash is None:
+            return True
+        if file.content_hash in self.in_progress:
+            self.in_progress[file.content_hash].append(file)
+            return False
+        self.in_progress[file.content_hash] = []
+        return True
+
+    def release(self, original: File, processed: bool) -> list[File]:
+        """
+        Mark the original as finished
+        :return: duplicates which were waiting for the original
+        """
+        # files not claimed as originals, e.g. with deduplication disabled
+        if original.content_hash not in self.in_progress:
+            return []
+        duplicates = self.in_progress.pop(original.content_hash)
+        if processed:
+            self.processed[original.content_hash] = original
+            if len(self.processed) > self.cache_size:
+                self.processed.popitem(last=False)
+        return duplicates
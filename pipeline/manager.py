@@ -0,0 +1,367 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import Optional
+
+from elasticsearch import AsyncElasticsearch, ConnectionError, TransportError
+from elasticsearch.helpers import BulkIndexError
+from httpx import AsyncClient
+from neo4j import AsyncDriver
+
+from config import config
+from elastic import index_file, delete_file_documents
+from entity_recognizer.similarity import SimilarityIndex
+from file_processor import File, Watcher, iter_files
+from file_processor.emails import process_email
+from file_processor.fs_crawler import EXTRACT_DIR_NAME, IGNORED_PREFIXES
+from utils import setup_logger, metrics
+from utils.exceptions import TikaError
+from .dedup import DuplicateRegistry
+from .manifest import Manifest, DONE, FAILED
+from .scheduler import CostModel
+from .stage import Stage
+from .work_queue import WorkQueue
+
+logger = setup_logger(__name__)
+
+
+class Pipeline:
+    """
+    Processes files in separate stages connected by bounded queues:
+    extraction -> (ocr) -> ner -> indexing, emails are additionally sent to the email stage.
+    In distributed mode files are leased from a work queue shared with other nodes.
+    """
+
+    def __init__(self, es: AsyncElasticsearch, client: AsyncClient, neo4j_driver: AsyncDriver, dataset_name: str,
+                 manifest: Manifest, work_queue: Optional[WorkQueue] = None):
+        self.es = es
+        self.client = client
+        self.neo4j_driver = neo4j_driver
+        self.dataset_name = dataset_name
+        self.manifest = manifest
+        self.work_queue = work_queue
+        # paths of files leased from the work queue by this node
+        self.leased: set[str] = set()
+        # paths of files being processed, in watch mode their changes are processed once they are finished
+        self.active: set[str] = set()
+        # parked files being put back into their stages are neither parked nor pending
+        self.resubmit_lock = asyncio.Lock()
+        # set on shutdown, files already admitted are still finished
+        self.stopping = False
+        self.watcher: Optional[Watcher] = None
+        self.duplicates = DuplicateRegistry(config.DEDUPLICATION_CACHE_SIZE)
+        self.similar_documents = SimilarityIndex(
+            config.NEAR_DUPLICATE_THRESHOLD,
+            config.MINHASH_PERMUTATIONS,
+            config.LSH_BANDS,
+            config.NEAR_DUPLICATE_INDEX_SIZE,
+        ) if config.NEAR_DUPLICATE_DETECTION else None
+        self.total_entities = 0
+        # number of files found and finished by their status
+        self.counts = Counter()
+        self.cost_model = CostModel(manifest.load_cost_history())
+
+        self.extraction = self._make_stage("extraction", self.extract)
+        self.ocr = self._make_stage("ocr", self.run_ocr)
+        self.ner = self._make_stage("ner", self.recognize_entities)
+        self.indexing = self._make_stage("indexing", self.index)
+        self.email = self._make_stage("email", self.index_email)
+        # files only move forward, so joining the stages in this order drains the whole pipeline
+        self.stages = [self.extraction, self.ocr, self.ner, self.indexing, self.email]
+
+    def _make_stage(self, name: str, handler) -> Stage:
+        # emails are indexed to Neo4j besides the main path, so their errors don't fail the file
+        on_error = self.fail if name != "email" else None
+        if name in config.SCHEDULER_BACKFILL_WORKERS:
+            # expensive files are started first so they don't become stragglers at the end
+            return Stage(name, handler, config.STAGE_WORKERS[name], config.QUEUE_SIZE, self.cost_model,
+                         config.SCHEDULER_BACKFILL_WORKERS[name], on_error=on_error)
+        return Stage(name, handler, config.STAGE_WORKERS[name], config.QUEUE_SIZE, on_error=on_error)
+
+    async def run(self, root_dir: str, crawl: bool = True, watch: bool = False):
+        """
+        Process all files in the root directory
+        :param crawl: in distributed mode, whether this node also looks for files and adds them to the work queue
+        :param watch: keep processing new or modified files until stopped, only in local mode
+        """
+        for stage in self.stages:
+            stage.start()
+        retry_task = asyncio.create_task(self.retry_parked())
+        try:
+            if self.work_queue is None:
+                # watching starts before the scan so files added during it aren't missed
+                self.watcher = Watcher(
+                    root_dir,
+                    ignored_dirs=(os.path.join(os.path.abspath(root_dir), EXTRACT_DIR_NAME),),
+                    ignored_prefixes=IGNORED_PREFIXES,
+                ) if watch else None
+                # files are fed to the first stage while the workers are already processing them
+                async for file in iter_files(root_dir):
+                    if self.stopping:
+                        break
+                    self.counts["found"] += 1
+                    await self.extraction.put(file)
+                logger.info(f"Found {self.counts['found']} files")
+                if self.watcher:
+                    await self.watch(root_dir, self.watcher)
+            else:
+                await self.run_distributed(root_dir, crawl)
+
+            await self.drain()
+        finally:
+            retry_task.cancel()
+            for stage in self.stages:
+                await stage.stop()
+            self.manifest.save_cost_history(self.cost_model.history)
+
+    def progress(self) -> dict:
+        return {
+            "found": self.counts["found"],
+            "processed": self.counts[DONE],
+            "failed": self.counts[FAILED],
+            "skipped": self.counts["skipped"],
+            "entities": self.total_entities,
+        }
+
+    async def watch(self, root_dir: str, watcher: Watcher):
+        """
+        Process new or modified files in the root directory until stopped
+        """
+        logger.info(f"Watching {root_dir} for new files...")
+        try:
+            async for paths in watcher.changes():
+                async for file in iter_files(root_dir, paths):
+                    if self.stopping:
+                        break
+                    if file.path in self.active:
+                        watcher.defer(file.path)
+                        continue
+                    self.active.add(file.path)
+                    self.counts["found"] += 1
+                    await self.extraction.put(file)
+        finally:
+            watcher.close()
+        logger.info("Stopped watching")
+
+    def stop(self):
+        """
+        Stop admitting new files, run returns once the files already admitted are processed
+        """
+        logger.info("Stopping, finishing the files being processed...")
+        self.stopping = True
+        if self.watcher:
+            self.watcher.stop()
+
+    async def drain(self):
+        """
+        Wait until all files including the parked ones are processed
+        """
+        while True:
+            for stage in self.stages:
+                await stage.join()
+            async with self.resubmit_lock:
+                # retry_parked might have put files back into stages which were already joined
+                if not any(stage.parked or stage.pending for stage in self.stages):
+                    return
+                has_parked = any(stage.parked for stage in self.stages)
+            if has_parked:
+                await asyncio.sleep(config.CIRCUIT_BREAKER_RESET_SECONDS)
+                await self.resubmit_parked()
+
+    async def retry_parked(self):
+        while True:
+            await asyncio.sleep(config.CIRCUIT_BREAKER_RESET_SECONDS)
+            await self.resubmit_parked()
+
+    async def resubmit_parked(self):
+        """
+        Put files parked because of an unavailable backend back into their stages,
+        if the backend is still unavailable they are parked again
+        """
+        async with self.resubmit_lock:
+            await self._resubmit_parked()
+
+    async def _resubmit_parked(self):
+        for stage in self.stages:
+            parked, stage.parked = stage.parked, []
+            for file in parked:
+                if file.times_parked > config.MAX_PARKED_RETRIES:
+                    if stage is self.email:
+                        # the file itself is finished by the other stages, only its email is missing in Neo4j
+                        logger.error(f"{file}: email could not be indexed to Neo4j, dropping it")
+                        continue
+                    await self.fail(file, stage.name)
+                    continue
+                if stage is self.indexing:
+                    # the file might have been indexed without its entities
+                    file.stale = True
+                await stage.put(file)
+
+    async def run_distributed(self, root_dir: str, crawl: bool):
+        crawl_task = None
+        if crawl:
+            # register before leasing so other nodes don't finish while the files are being discovered
+            await self.work_queue.crawler_heartbeat()
+            crawl_task = asyncio.create_task(self.crawl(root_dir))
+        heartbeat_task = asyncio.create_task(self.send_heartbeats(crawl_task))
+        try:
+            await self.lease_files()
+            if crawl_task:
+                await crawl_task
+        finally:
+            heartbeat_task.cancel()
+            if crawl_task:
+                crawl_task.cancel()
+            await asyncio.gather(heartbeat_task, return_exceptions=True)
+
+    async def crawl(self, root_dir: str):
+        n_files = 0
+        try:
+            async for file in iter_files(root_dir, shared=True):
+                await self.work_queue.enqueue(file)
+                n_files += 1
+        finally:
+            await self.work_queue.crawler_heartbeat(active=False)
+        logger.info(f"Found {n_files} files")
+
+    async def send_heartbeats(self, crawl_task: Optional[asyncio.Task]):
+        while True:
+            await asyncio.sleep(config.WORK_QUEUE_LEASE_SECONDS / 3)
+            await self.work_queue.heartbeat(list(self.leased))
+            if crawl_task and not crawl_task.done():
+                await self.work_queue.crawler_heartbeat()
+
+    async def lease_files(self):
+        """
+        Feed files leased from the work queue to the first stage until all files of the dataset are processed
+        """
+        while True:
+            free_slots = self.extraction.queue.maxsize - self.extraction.queue.qsize()
+            files = await self.work_queue.lease(free_slots) if free_slots > 0 else []
+            for file in files:
+                self.leased.add(file.path)
+                await self.extraction.put(file)
+            if files:
+                continue
+
+            # files leased by other nodes are delivered again if their lease expires
+            if not await self.work_queue.is_crawling() and not await self.work_queue.has_pending():
+                break
+            await asyncio.sleep(config.WORK_QUEUE_POLL_SECONDS)
+
+    async def release(self, file: File, status: str):
+        # the file won't be processed further in this node
+        self.active.discard(file.path)
+        if file.path in self.leased:
+            self.leased.discard(file.path)
+            await self.work_queue.complete(file.path, status)
+
+    async def finish(self, file: File, stage: str, status: str):
+        await self.manifest.mark(file, stage, status)
+        self.counts[status] += 1
+        metrics.inc("files_processed_total", status=status)
+        if status == DONE:
+            metrics.inc("bytes_processed_total", file.size)
+        if file.started_at is not None:
+            metrics.observe("file_processing_seconds", time.perf_counter() - file.started_at)
+        await self.release(file, status)
+
+    async def fail(self, file: File, stage: str):
+        logger.error(f"{file}: could not be processed!")
+        await self.finish(file, stage, FAILED)
+        # duplicates have the same content, so they would fail as well
+        for duplicate in self.duplicates.release(file, processed=False):
+            logger.error(f"{duplicate}: could not be processed!")
+            await self.finish(duplicate, stage, FAILED)
+
+    async def reuse_results(self, file: File, original: File):
+        logger.info(f"{file}: duplicate of {original}, reusing its results")
+        file.copy_results(original)
+        if file.is_email:
+            await self.email.put(file)
+        await self.indexing.put(file)
+
+    async def extract(self, file: File):
+        # parked files were already admitted
+        if file.started_at is None:
+            self.active.add(file.path)
+            if not await self.manifest.needs_processing(file):
+                logger.info(f"{file}: already processed, skipping")
+                metrics.inc("files_processed_total", status="skipped")
+                self.counts["skipped"] += 1
+                await self.release(file, DONE)
+                return
+
+            file.started_at = time.perf_counter()
+            if config.DEDUPLICATE:
+                original = self.duplicates.find_original(file)
+                if original:
+                    await self.reuse_results(file, original)
+                    return
+                if not self.duplicates.claim(file):
+                    # results will be reused once the original is processed
+                    return
+
+        logger.info(f"Processing {file}")
+        start = time.perf_counter()
+        try:
+            if not await file.extract_metadata():
+                await self.fail(file, "extraction")
+                return
+
+            if file.is_email:
+                await self.email.put(file)
+
+            if file.needs_ocr:
+                # extraction of the metadata is learned separately from the ocr
+                self.cost_model.record("extraction", file, time.perf_counter() - start)
+                await self.ocr.put(file)
+                return
+
+            has_plaintext = await file.extract_text()
+            self.cost_model.record("extraction", file, time.perf_counter() - start)
+        except TikaError as e:
+            logger.error(f"{file}: Error while communicating with Tika - {e}")
+            await self.fail(file, "extraction")
+            return
+
+        if not has_plaintext:
+            await self.fail(file, "extraction")
+            return
+        await self.manifest.mark(file, "extraction")
+        await self.ner.put(file)
+
+    async def run_ocr(self, file: File):
+        start = time.perf_counter()
+        has_plaintext = await file.ocr()
+        self.cost_model.record("ocr", file, time.perf_counter() - start)
+        if not has_plaintext:
+            await self.fail(file, "ocr")
+            return
+        await self.manifest.mark(file, "ocr")
+        await self.ner.put(file)
+
+    async def recognize_entities(self, file: File):
+        await file.recognize_entities(self.client, self.similar_documents)
+        await self.manifest.mark(file, "ner")
+        await self.indexing.put(file)
+        for duplicate in self.duplicates.release(file, processed=True):
+            await self.reuse_results(duplicate, file)
+
+    async def index(self, file: File):
+        try:
+            if file.stale:
+                await delete_file_documents(self.es, self.dataset_name, file.path)
+            await index_file(self.es, self.dataset_name, file)
+        except (ConnectionError, TransportError, BulkIndexError) as e:
+            logger.error(f"{file}: Cannot index to Elasticsearch - {e}")
+            await self.finish(file, "indexing", FAILED)
+            return
+
+        await self.finish(file, "indexing", DONE)
+        self.total_entities += len(file.entities)
+        logger.info(f"{file}: finished with {len(file.entities)} entities!")
+
+    async def index_email(self, file: File):
+        await process_email(self.neo4j_driver, file.path, file.metadata)
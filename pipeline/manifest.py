@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from file_processor import File
+from file_processor.archives import is_virtual, stat_path
+from file_processor.metadata import get_file_hash
+from utils import setup_logger, run_sync_fn_async_io
+
+logger = setup_logger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class Manifest:
+    """
+    Persistent record of processed files stored in SQLite next to the dataset.
+    Files are identified by path, size, modification time and content hash, so restarts skip
+    already indexed files and only new or changed files are processed again.
+    """
+
+    def __init__(self, db_path: str, dataset_name: str, shared: bool = False):
+        self.db_path = db_path
+        self.dataset_name = dataset_name
+        # queries run in threads of the io pool so a locked database doesn't block the event loop,
+        # access is serialized by the lock
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        # WAL mode doesn't work when the manifest is shared by nodes over a network file system
+        self.conn.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                dataset TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                content_hash TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (dataset, path)
+            )
+            """
+        )
+        # durations of processing used by the scheduler, not specific to a dataset
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cost_history (
+                stage TEXT NOT NULL,
+                format TEXT NOT NULL,
+                n REAL NOT NULL,
+                sum_x REAL NOT NULL,
+                sum_y REAL NOT NULL,
+                sum_xx REAL NOT NULL,
+                sum_xy REAL NOT NULL,
+                PRIMARY KEY (stage, format)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _lookup(self, path: str) -> Optional[tuple[int, float, str, str]]:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT size, mtime, content_hash, status FROM files WHERE dataset = ? AND path = ?",
+                (self.dataset_name, path),
+            ).fetchone()
+
+    async def needs_processing(self, file: File) -> bool:
+        """
+        Check if the file has to be processed and register it in the manifest if so
+        :return: False if the same content of the file was already indexed
+        """
+        # stats of archive members are already known from the crawler and reading them again is expensive
+        if not is_virtual(file.path) or not file.mtime:
+            file.size, file.mtime = await run_sync_fn_async_io(stat_path, file.path, io_pool="filesystem")
+
+        row = await run_sync_fn_async_io(self._lookup, file.path)
+        if row:
+            size, mtime, content_hash, status = row
+            if status == DONE and size == file.size and mtime == file.mtime:
+                return False
+
+        if file.content_hash is None:
+            file.content_hash = await run_sync_fn_async_io(get_file_hash, file.path, io_pool="filesystem")
+
+        if row:
+            if status == DONE and content_hash == file.content_hash:
+                # file was only touched, remember new stats so it isn't hashed next time
+                await run_sync_fn_async_io(self._update, file, "indexing", DONE)
+                return False
+            # documents of the file might be already indexed from the previous run
+            file.stale = True
+
+        await run_sync_fn_async_io(self._update, file, "discovered", PENDING)
+        return True
+
+    def load_cost_history(self) -> dict[tuple[str, str], list[float]]:
+        with self.lock:
+            rows = self.conn.execute("SELECT stage, format, n, sum_x, sum_y, sum_xx, sum_xy FROM cost_history")
+            return {(stage, file_format): list(sums) for stage, file_format, *sums in rows}
+
+    def save_cost_history(self, history: dict[tuple[str, str], list[float]]):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cost_history (stage, format, n, sum_x, sum_y, sum_xx, sum_xy) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(stage, file_format, *sums) for (stage, file_format), sums in history.items() if file_format],
+            )
+            self.conn.commit()
+
+    async def mark(self, file: File, stage: str, status: str = PENDING):
+        """
+        Record that the file has finished the stage with given status
+        """
+        await run_sync_fn_async_io(self._update, file, stage, status)
+
+    def _update(self, file: File, stage: str, status: str):
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT INTO files (dataset, path, size, mtime, content_hash, stage, status, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (dataset, path) DO UPDATE SET
+                    size = excluded.size, mtime = excluded.mtime, content_hash = excluded.content_hash,
+                    stage = excluded.stage, status = excluded.status, updated = excluded.updated
+                """,
+                # files which failed before they were hashed have no content hash
+                (self.dataset_name, file.path, file.size, file.mtime, file.content_hash or "", stage, status,
+                 time.time()),
+            )
+            self.conn.commit()
@@ -0,0 +1,93 @@
+import asyncio
+import bisect
+import itertools
+from typing import Callable
+
+from config import config
+from file_processor import File
+
+
+class CostModel:
+    """
+    Estimates processing time of a file in a stage from its format and size.
+    Configured defaults are replaced by a linear fit of durations observed in previous runs.
+    """
+
+    def __init__(self, history: dict[tuple[str, str], list[float]] | None = None):
+        # (stage, format) -> [n, sum_x, sum_y, sum_xx, sum_xy] where x is size in MB and y is duration
+        self.history: dict[tuple[str, str], list[float]] = history or {}
+
+    def estimate(self, stage: str, file: File) -> float:
+        size_mb = file.size / 2 ** 20
+        sums = self.history.get((stage, file.format))
+        if sums and sums[0] >= config.SCHEDULER_MIN_SAMPLES:
+            n, sum_x, sum_y, sum_xx, sum_xy = sums
+            variance = n * sum_xx - sum_x ** 2
+            slope = (n * sum_xy - sum_x * sum_y) / variance if variance > 0 else 0
+            slope = max(slope, 0)
+            intercept = max((sum_y - slope * sum_x) / n, 0)
+            return intercept + slope * size_mb
+
+        format_costs = config.SCHEDULER_FORMAT_COSTS.get(stage, {})
+        base, per_mb = format_costs.get(file.format, config.SCHEDULER_DEFAULT_COST)
+        return base + per_mb * size_mb
+
+    def record(self, stage: str, file: File, duration: float):
+        size_mb = file.size / 2 ** 20
+        sums = self.history.setdefault((stage, file.format), [0, 0, 0, 0, 0])
+        sums[0] += 1
+        sums[1] += size_mb
+        sums[2] += duration
+        sums[3] += size_mb ** 2
+        sums[4] += size_mb * duration
+
+
+class CostQueue:
+    """
+    Bounded queue of files ordered by their estimated cost.
+    Workers take the most expensive files first, backfill workers take the cheapest ones.
+    Has the same interface as asyncio.Queue used by the pipeline stages.
+    """
+
+    def __init__(self, maxsize: int, cost: Callable[[File], float]):
+        self.maxsize = maxsize
+        self.cost = cost
+        self._items: list[tuple[float, int, File]] = []
+        # insertion order breaks ties, files are never compared
+        self._counter = itertools.count()
+        self._unfinished_tasks = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+        self._changed = asyncio.Condition()
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._items)
+
+    async def put(self, file: File):
+        async with self._changed:
+            await self._changed.wait_for(lambda: not self.full())
+            bisect.insort(self._items, (self.cost(file), next(self._counter), file))
+            self._unfinished_tasks += 1
+            self._finished.clear()
+            self._changed.notify_all()
+
+    async def get(self, largest: bool = True) -> File:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._items)
+            _, _, file = self._items.pop() if largest else self._items.pop(0)
+            self._changed.notify_all()
+            return file
+
+    def task_done(self):
+        self._unfinished_tasks -= 1
+        if self._unfinished_tasks == 0:
+            self._finished.set()
+
+    async def join(self):
+        await self._finished.wait()
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional
+
+from aiohttp import web
+from elasticsearch import AsyncElasticsearch
+from httpx import AsyncClient
+from neo4j import AsyncDriver
+
+from config import config
+from elastic import assert_index_exists
+from utils import setup_logger
+from .manager import Pipeline
+from .manifest import Manifest
+
+logger = setup_logger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    def __init__(self, root_dir: str, dataset_name: str):
+        self.id = uuid.uuid4().hex
+        self.root_dir = root_dir
+        self.dataset_name = dataset_name
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.pipeline: Optional[Pipeline] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "directory": self.root_dir,
+            "dataset": self.dataset_name,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": self.pipeline.progress() if self.pipeline else None,
+        }
+
+
+class JobService:
+    """
+    Long-running service which processes ingestion jobs submitted over a local HTTP API,
+    the connections to backends and the worker processes with loaded models are shared by all jobs.
+
+    POST /jobs {"directory": ..., "dataset": ...} submits a job, GET /jobs and GET /jobs/<id> show status
+    and progress, DELETE /jobs/<id> cancels the job.
+    """
+
+    def __init__(self, es: AsyncElasticsearch, client: AsyncClient, neo4j_driver: AsyncDriver, data_root: str):
+        self.es = es
+        self.client = client
+        self.neo4j_driver = neo4j_driver
+        self.data_root = os.path.abspath(data_root)
+        self.jobs: dict[str, Job] = {}
+        self.slots = asyncio.Semaphore(config.SERVICE_MAX_JOBS)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/jobs", self.handle_submit)
+        app.router.add_get("/jobs", self.handle_list)
+        app.router.add_get("/jobs/{job_id}", self.handle_get)
+        app.router.add_delete("/jobs/{job_id}", self.handle_cancel)
+        return app
+
+    async def start(self, socket_path: Optional[str] = None, port: Optional[int] = None) -> web.AppRunner:
+        """
+        Serve the API on a Unix socket if given, otherwise on the local TCP port
+        """
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        if socket_path:
+            site = web.UnixSite(runner, socket_path)
+        else:
+            site = web.TCPSite(runner, "localhost", port)
+        await site.start()
+        return runner
+
+    async def stop(self):
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, root_dir: str, dataset_name: str) -> Job:
+        job = Job(root_dir, dataset_name)
+        job.task = asyncio.create_task(self.run_job(job))
+        self.jobs[job.id] = job
+        logger.info(f"Job {job.id}: {root_dir} submitted to dataset {dataset_name}")
+        return job
+
+    async def run_job(self, job: Job):
+        manifest = None
+        try:
+            async with self.slots:
+                job.status = RUNNING
+                job.started = time.time()
+                await assert_index_exists(self.es, job.dataset_name)
+                manifest = Manifest(os.path.join(job.root_dir, config.MANIFEST_FILENAME), job.dataset_name)
+                job.pipeline = Pipeline(self.es, self.client, self.neo4j_driver, job.dataset_name, manifest)
+                await job.pipeline.run(job.root_dir)
+                job.status = DONE
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            logger.error(f"Job {job.id}: failed - {e}")
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            if manifest:
+                manifest.close()
+        logger.info(f"Job {job.id}: {job.status}")
+
+    def resolve_directory(self, directory: str) -> str:
+        """
+        Directory of the job relative to the data root, it mustn't point outside of it
+        """
+        root_dir = os.path.abspath(os.path.join(self.data_root, directory))
+        if os.path.commonpath([root_dir, self.data_root]) != self.data_root:
+            raise web.HTTPBadRequest(reason="directory must be inside the data directory")
+        if not os.path.isdir(root_dir):
+            raise web.HTTPBadRequest(reason="directory doesn't exist")
+        return root_dir
+
+    def get_job(self, request: web.Request) -> Job:
+        job = self.jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound(reason="unknown job")
+        return job
+
+    async def handle_submit(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+            directory = body["directory"]
+            dataset_name = body["dataset"]
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPBadRequest(reason="expected JSON with directory and dataset")
+
+        # index name must be lowercase
+        job = self.submit(self.resolve_directory(directory), dataset_name.lower())
+        return web.json_response(job.to_dict(), status=201)
+
+    async def handle_list(self, _: web.Request) -> web.Response:
+        return web.json_response([job.to_dict() for job in self.jobs.values()])
+
+    async def handle_get(self, request: web.Request) -> web.Response:
+        return web.json_response(self.get_job(request).to_dict())
+
+    async def handle_cancel(self, request: web.Request) -> web.Response:
+        job = self.get_job(request)
+        if job.task and not job.task.done():
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        return web.json_response(job.to_dict())
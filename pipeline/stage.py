@@ -0,0 +1,98 @@
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from file_processor import File
+from utils import setup_logger, metrics
+from utils.exceptions import CircuitOpenError
+from .scheduler import CostModel, CostQueue
+
+logger = setup_logger(__name__)
+
+
+class Stage:
+    """
+    One step of the pipeline with its own bounded queue and pool of worker coroutines
+    """
+
+    def __init__(self, name: str, handler: Callable[[File], Awaitable[None]], n_workers: int, queue_size: int,
+                 cost_model: Optional[CostModel] = None, backfill_workers: int = 0,
+                 on_error: Optional[Callable[[File, str], Awaitable[None]]] = None):
+        """
+        :param cost_model: if given, files are scheduled by their estimated cost, the most expensive first
+        :param backfill_workers: number of workers which take the cheapest files instead
+        :param on_error: called with the file and the name of the stage when the handler fails unexpectedly
+        """
+        self.name = name
+        self.handler = handler
+        self.on_error = on_error
+        self.n_workers = n_workers
+        self.backfill_workers = backfill_workers if cost_model else 0
+        if cost_model:
+            self.queue = CostQueue(queue_size, partial(cost_model.estimate, name))
+        else:
+            self.queue: asyncio.Queue[File] = asyncio.Queue(maxsize=queue_size)
+        self.tasks: list[asyncio.Task] = []
+        # files waiting for an unavailable backend, they are put into the queue again later
+        self.parked: list[File] = []
+        # files put into the stage and not processed yet, including those waiting for a free slot in the queue
+        self.pending = 0
+        metrics.gauge("queue_depth", self.queue.qsize, stage=name)
+        metrics.gauge("parked_files", lambda: len(self.parked), stage=name)
+
+    async def put(self, file: File):
+        # waits while the queue is full so previous stages can't run far ahead
+        self.pending += 1
+        try:
+            await self.queue.put(file)
+        except asyncio.CancelledError:
+            self.pending -= 1
+            raise
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.worker(backfill=i < self.backfill_workers)) for i in range(self.n_workers)
+        ]
+
+    async def join(self):
+        await self.queue.join()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        # Wait until all worker tasks are cancelled.
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def worker(self, backfill: bool = False):
+        while True:
+            file: File = await self.queue.get(largest=False) if backfill else await self.queue.get()
+            try:
+                with metrics.timer("stage_seconds", stage=self.name):
+                    await self.handler(file)
+            except CircuitOpenError as e:
+                logger.warning(f"{file}: parked in {self.name} stage - {e}")
+                file.times_parked += 1
+                self.parked.append(file)
+            except httpx.ReadTimeout:
+                logger.error(f"{file}: Read Timeout in {self.name} stage")
+                await self.handle_error(file)
+            except Exception as e:
+                logger.error(f"{file}: Fatal error in {self.name} stage - {e}")
+                await self.handle_error(file)
+            finally:
+                self.pending -= 1
+                self.queue.task_done()
+
+    async def handle_error(self, file: File):
+        if self.on_error is None:
+            return
+        try:
+            await self.on_error(file, self.name)
+        except Exception as e:
+            logger.error(f"{file}: Cannot record failure in {self.name} stage - {e}")
+
+    def __str__(self):
+        return f"Stage({self.name})"
@@ -0,0 +1,179 @@
+import sqlite3
+import threading
+import time
+
+from config import config
+from file_processor import File
+from utils import setup_logger, run_sync_fn_async_io
+
+logger = setup_logger(__name__)
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """
+    Work queue shared by several nodes, backed by a SQLite table on shared storage.
+    Nodes lease files for a limited time and extend the leases by heartbeats,
+    files leased by a node which stopped sending heartbeats are delivered again to another node.
+    """
+
+    def __init__(self, db_path: str, dataset_name: str, node_id: str):
+        self.dataset_name = dataset_name
+        self.node_id = node_id
+        # connection is used from the threads of the io pool, access is serialized by the lock
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        # WAL mode doesn't work on network file systems
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS work (
+                dataset TEXT NOT NULL,
+                path TEXT NOT NULL,
+                format TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                mtime REAL NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dataset, path)
+            )
+            """
+        )
+        if "mtime" not in {column for _, column, *_ in self.conn.execute("PRAGMA table_info(work)")}:
+            # queue created by a previous version
+            self.conn.execute("ALTER TABLE work ADD COLUMN mtime REAL NOT NULL DEFAULT 0")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS crawlers (
+                dataset TEXT NOT NULL,
+                node TEXT NOT NULL,
+                heartbeat REAL NOT NULL,
+                PRIMARY KEY (dataset, node)
+            )
+            """
+        )
+
+    def close(self):
+        self.conn.close()
+
+    def _execute(self, query: str, parameters=()) -> list[tuple]:
+        with self.lock:
+            return self.conn.execute(query, parameters).fetchall()
+
+    def _enqueue(self, file: File):
+        # finished files are queued again only when they have changed, files are hashed by the nodes processing them
+        self._execute(
+            """
+            INSERT INTO work (dataset, path, format, size, mtime, state) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (dataset, path) DO UPDATE SET
+                format = excluded.format, size = excluded.size, mtime = excluded.mtime,
+                state = excluded.state, owner = NULL, lease_until = 0, attempts = 0
+            WHERE work.state IN (?, ?) AND (work.size != excluded.size OR work.mtime != excluded.mtime)
+            """,
+            (self.dataset_name, file.path, file.format, file.size, file.mtime, QUEUED, DONE, FAILED),
+        )
+
+    async def enqueue(self, file: File):
+        await run_sync_fn_async_io(self._enqueue, file)
+
+    def _lease(self, n_files: int) -> list[File]:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # files which were delivered too many times are probably crashing the nodes
+                self.conn.execute(
+                    "UPDATE work SET state = ? WHERE dataset = ? AND state = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, self.dataset_name, LEASED, now, config.WORK_QUEUE_MAX_ATTEMPTS),
+                )
+                rows = self.conn.execute(
+                    """
+                    SELECT path, format, size, mtime FROM work
+                    WHERE dataset = ? AND (state = ? OR (state = ? AND lease_until < ?))
+                    LIMIT ?
+                    """,
+                    (self.dataset_name, QUEUED, LEASED, now, n_files),
+                ).fetchall()
+                self.conn.executemany(
+                    """
+                    UPDATE work SET state = ?, owner = ?, lease_until = ?, attempts = attempts + 1
+                    WHERE dataset = ? AND path = ?
+                    """,
+                    [(LEASED, self.node_id, now + config.WORK_QUEUE_LEASE_SECONDS, self.dataset_name, path)
+                     for path, *_ in rows],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        files = []
+        for path, file_format, size, mtime in rows:
+            file = File(path, file_format)
+            file.size = size
+            file.mtime = mtime
+            files.append(file)
+        return files
+
+    async def lease(self, n_files: int) -> list[File]:
+        return await run_sync_fn_async_io(self._lease, n_files)
+
+    def _heartbeat(self, paths: list[str]):
+        lease_until = time.time() + config.WORK_QUEUE_LEASE_SECONDS
+        self._execute(
+            "UPDATE work SET lease_until = ? WHERE dataset = ? AND owner = ? AND state = ? AND path IN "
+            f"({', '.join('?' * len(paths))})",
+            (lease_until, self.dataset_name, self.node_id, LEASED, *paths),
+        )
+
+    async def heartbeat(self, paths: list[str]):
+        if paths:
+            await run_sync_fn_async_io(self._heartbeat, paths)
+
+    def _complete(self, path: str, state: str):
+        # the lease might have expired and the file was delivered to another node
+        self._execute(
+            "UPDATE work SET state = ?, lease_until = 0 WHERE dataset = ? AND path = ? AND owner = ? AND state = ?",
+            (state, self.dataset_name, path, self.node_id, LEASED),
+        )
+
+    async def complete(self, path: str, state: str):
+        await run_sync_fn_async_io(self._complete, path, state)
+
+    def _has_pending(self) -> bool:
+        rows = self._execute(
+            "SELECT 1 FROM work WHERE dataset = ? AND state IN (?, ?) LIMIT 1",
+            (self.dataset_name, QUEUED, LEASED),
+        )
+        return bool(rows)
+
+    async def has_pending(self) -> bool:
+        return await run_sync_fn_async_io(self._has_pending)
+
+    def _crawler_heartbeat(self, active: bool):
+        if active:
+            self._execute(
+                "INSERT OR REPLACE INTO crawlers (dataset, node, heartbeat) VALUES (?, ?, ?)",
+                (self.dataset_name, self.node_id, time.time()),
+            )
+        else:
+            self._execute("DELETE FROM crawlers WHERE dataset = ? AND node = ?", (self.dataset_name, self.node_id))
+
+    async def crawler_heartbeat(self, active: bool = True):
+        await run_sync_fn_async_io(self._crawler_heartbeat, active)
+
+    def _is_crawling(self) -> bool:
+        rows = self._execute(
+            "SELECT 1 FROM crawlers WHERE dataset = ? AND heartbeat > ? LIMIT 1",
+            (self.dataset_name, time.time() - config.WORK_QUEUE_LEASE_SECONDS),
+        )
+        return bool(rows)
+
+    async def is_crawling(self) -> bool:
+        return await run_sync_fn_async_io(self._is_crawling)
@@ -0,0 +1,20 @@
+from config import config
+from entity_recognizer import spacy
+from file_processor import ocr
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def initialize_worker():
+    """
+    Initializer of the process pool workers, loads the models once per process
+    """
+    if not config.PRELOAD_MODELS:
+        return
+    try:
+        ocr.warm_up()
+        spacy.warm_up()
+    except Exception as e:
+        # models are loaded on first use instead
+        logger.error(f"Could not preload models in worker process: {e}")
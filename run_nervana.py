@@ -1,12 +1,16 @@
+import argparse
 import asyncio
+import json
 import os
+import signal
+import socket
 import sys
 import time
+from contextlib import asynccontextmanager
 from json import JSONDecodeError
-from typing import Tuple
+from typing import AsyncIterator, Optional
 
 import httpx
-import requests
 from dotenv import load_dotenv
 from elasticsearch import AsyncElasticsearch
 from elasticsearch.exceptions import AuthenticationException
@@ -18,68 +22,34 @@ from elastic import (
     get_async_elastic_client,
     test_connection_async,
     assert_index_exists,
-    index_file,
 )
-from file_processor import *
-from utils import setup_logger
-from utils.exceptions import *
+from file_processor import close_tika_client
+from pipeline import Pipeline, Manifest, WorkQueue, JobService
+from pipeline.workers import initialize_worker
+from utils import (
+    setup_logger,
+    metrics,
+    start_metrics_server,
+    start_process_pool,
+    shutdown_process_pool,
+    shutdown_io_pools,
+)
 
-entities_count_lock = asyncio.Lock()
-total_entities = 0
 logger = setup_logger(__name__)
 
-
-async def process_one_file(
-        es: AsyncElasticsearch,
-        client: AsyncClient,
-        neo4j_driver: AsyncDriver,
-        file: File,
-        dataset_name: str,
-):
-    global total_entities
-    try:
-        logger.info(f"Processing {file}")
-        await file.process(client, neo4j_driver)
-
-        if not file.valid:
-            logger.error(f"{file}: could not be processed!")
-            return
-
-        await index_file(es, dataset_name, file)
-
-        async with entities_count_lock:
-            total_entities += len(file.entities)
-        logger.info(f"{file}: finished with {len(file.entities)} entities!")
-
-    except TikaError as e:
-        logger.error(f"{file}: Error while communicating with Tika - {e}")
-    except ConnectionError:
-        logger.error(f"{file}: Cannot connect to Elasticsearch")
-    except (httpx.ReadTimeout, requests.exceptions.ReadTimeout):
-        logger.error(f"{file}: Read Timeout")
-
-
-async def worker(
-        task_queue,
-        es: AsyncElasticsearch,
-        client: AsyncClient,
-        neo4j_driver: AsyncDriver,
-        dataset_name: str,
-):
-    while True:
-        try:
-            file: File = await task_queue.get()
-            await process_one_file(es, client, neo4j_driver, file, dataset_name)
-        except Exception as e:
-            logger.error(f"{file}: Fatal error - {e}")
-        finally:
-            task_queue.task_done()
+# directory with all datasets, paths of the data directories are relative to it
+DATA_DIR = "/nervana_data"
 
 
-async def run_pipeline(files: list[File], dataset_name: str):
+@asynccontextmanager
+async def initialize_pipeline() -> AsyncIterator[tuple[AsyncElasticsearch, AsyncClient, AsyncDriver]]:
+    """
+    Connect to the backends and start the worker processes, shut everything down on exit
+    """
+    es = None
+    neo4j_driver = None
+    metrics_runner = None
     try:
-        # index name must be lowercase
-        dataset_name = dataset_name.lower()
         logger.info("Initializing NERvana pipeline...")
         es = get_async_elastic_client()
 
@@ -94,33 +64,18 @@ async def run_pipeline(files: list[File], dataset_name: str):
             await test_neo4j_connection(neo4j_driver)
             logger.info("Testing Elasticsearch connection...")
             await test_connection_async(es)
-            logger.info("Checking index in elasticsearch...")
-            await assert_index_exists(es, dataset_name)
             logger.info("DONE")
+            logger.info("Starting worker processes...")
+            start_process_pool(config.PROCESS_POOL_WORKERS, initialize_worker)
+            if config.METRICS_PORT:
+                try:
+                    metrics_runner = await start_metrics_server(config.METRICS_PORT)
+                    logger.info(f"Serving metrics on http://localhost:{config.METRICS_PORT}/metrics")
+                except OSError as e:
+                    # metrics are optional, the processing doesn't depend on them
+                    logger.warning(f"Cannot serve metrics on port {config.METRICS_PORT}, endpoint disabled - {e}")
             logger.info("Ready to process files...")
-
-            task_queue = asyncio.Queue()
-            # Add files to the task queue
-            for file in files:
-                task_queue.put_nowait(file)
-
-            n_workers = config.NUM_WORKERS  # Number of worker coroutines
-            # Create workers
-            tasks = [
-                asyncio.create_task(
-                    worker(task_queue, es, client, neo4j_driver, dataset_name)
-                )
-                for _ in range(n_workers)
-            ]
-
-            # Wait for all tasks in the queue to be processed
-            await task_queue.join()
-
-            # Cancel our worker tasks.
-            for task in tasks:
-                task.cancel()
-            # Wait until all worker tasks are cancelled.
-            await asyncio.gather(*tasks, return_exceptions=True)
+            yield es, client, neo4j_driver
 
     except EnvironmentError as e:
         logger.error("Error while trying to read environment variables:", e)
@@ -139,14 +94,84 @@ async def run_pipeline(files: list[File], dataset_name: str):
         exit(1)
 
     finally:
+        shutdown_process_pool()
+        shutdown_io_pools()
+        await close_tika_client()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         if es:
             await es.close()
         if neo4j_driver:
             await neo4j_driver.close()
 
 
-def get_cl_arguments() -> Tuple[str, str]:
-    return sys.argv[1], sys.argv[2]
+async def run_pipeline(root_dir: str, dataset_name: str, queue_path: Optional[str] = None, crawl: bool = True,
+                       node_id: Optional[str] = None, watch: bool = False) -> int:
+    # index name must be lowercase
+    dataset_name = dataset_name.lower()
+    async with initialize_pipeline() as (es, client, neo4j_driver):
+        logger.info("Checking index in elasticsearch...")
+        await assert_index_exists(es, dataset_name)
+
+        manifest = Manifest(os.path.join(root_dir, config.MANIFEST_FILENAME), dataset_name, shared=bool(queue_path))
+        work_queue = None
+        if queue_path:
+            node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+            logger.info(f"Running in distributed mode as node {node_id}")
+            work_queue = WorkQueue(queue_path, dataset_name, node_id)
+        try:
+            pipeline = Pipeline(es, client, neo4j_driver, dataset_name, manifest, work_queue)
+            if watch:
+                # stop watching gracefully when the container is stopped, files in flight are finished
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, pipeline.stop)
+            await pipeline.run(root_dir, crawl, watch)
+        finally:
+            manifest.close()
+            if work_queue:
+                work_queue.close()
+        return pipeline.total_entities
+
+
+async def run_service(socket_path: Optional[str], port: int):
+    """
+    Keep the backends connected and process jobs submitted over the local API until stopped
+    """
+    async with initialize_pipeline() as (es, client, neo4j_driver):
+        service = JobService(es, client, neo4j_driver, DATA_DIR)
+        runner = await service.start(socket_path, port)
+        logger.info(f"Accepting jobs on {socket_path or f'http://localhost:{port}/jobs'}")
+        stopped = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+        try:
+            await stopped.wait()
+        finally:
+            await service.stop()
+            await runner.cleanup()
+            logger.info("Service stopped")
+
+
+def get_cl_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="NERvana pipeline")
+    parser.add_argument("data_dir", nargs="?", help=f"directory with data relative to {DATA_DIR}")
+    parser.add_argument("dataset_name", nargs="?", help="name of the dataset (Elasticsearch index)")
+    parser.add_argument("--queue", dest="queue_path",
+                        help="path to the work queue shared by all nodes, enables distributed mode")
+    parser.add_argument("--no-crawl", dest="crawl", action="store_false",
+                        help="in distributed mode only process files added to the work queue by other nodes")
+    parser.add_argument("--node-id", help="identifier of this node in distributed mode, hostname-pid by default")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and process new or modified files in the directory")
+    parser.add_argument("--serve", action="store_true",
+                        help="run as a service accepting jobs over a local HTTP API instead of processing a directory")
+    parser.add_argument("--socket", dest="socket_path", help="with --serve, listen on this Unix socket")
+    parser.add_argument("--port", type=int, default=config.SERVICE_PORT,
+                        help=f"with --serve, listen on this local port, {config.SERVICE_PORT} by default")
+    args = parser.parse_args()
+    if args.watch and args.queue_path:
+        parser.error("--watch can't be used in distributed mode")
+    if not args.serve and (args.data_dir is None or args.dataset_name is None):
+        parser.error("data_dir and dataset_name are required unless --serve is used")
+    return args
 
 
 async def initialize_nametag(client: AsyncClient):
@@ -182,24 +207,28 @@ async def test_neo4j_connection(driver: AsyncDriver):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Please provide a root directory and a dataset name", file=sys.stderr)
-        exit(1)
+    args = get_cl_arguments()
     load_dotenv()
 
-    data_dir, dataset_name = get_cl_arguments()
-    root_dir = os.path.join("/nervana_data", data_dir)
+    if args.serve:
+        asyncio.run(run_service(args.socket_path, args.port))
+        exit(0)
+
+    root_dir = os.path.join(DATA_DIR, args.data_dir)
     logger.info(f"Looking for files in directory: {root_dir}")
     start_time = time.time()
-    try:
-        files: list[File] = get_files(root_dir)
-    except NotADirectoryError:
+    if not os.path.isdir(root_dir):
         print("Path specified is not a directory:", file=sys.stderr)
         exit(1)
 
-    logger.info(f"Found {len(files)} files")
+    total_entities = asyncio.run(
+        run_pipeline(root_dir, args.dataset_name, args.queue_path, args.crawl, args.node_id, args.watch)
+    )
 
-    asyncio.run(run_pipeline(files, dataset_name))
+    summary = metrics.summary()
+    with open(config.METRICS_SUMMARY_FILE, "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    logger.info(f"Metrics summary written to {config.METRICS_SUMMARY_FILE}")
 
     duration = time.time() - start_time
     logger.info(
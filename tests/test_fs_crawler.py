@@ -0,0 +1,68 @@
+import tarfile
+import zipfile
+
+import pytest
+
+from file_processor.archives import NotStreamableError, member_path
+from file_processor.fs_crawler import EXTRACT_DIR_NAME, iter_file_paths, walk_archive
+
+
+def test_walk_archive_streams_zip_members(tmp_path):
+    content = b"Jan Novak lives in Prague and works for Example Ltd.\n" * 20
+    archive_path = str(tmp_path / "documents.zip")
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("reports/notes.txt", content)
+
+    files = list(walk_archive(archive_path))
+
+    assert [file.path for file in files] == [member_path(archive_path, "reports/notes.txt")]
+    assert files[0].format == ".txt"
+    assert files[0].size == len(content)
+
+
+def test_walk_archive_leaves_compressed_tar_to_extraction(tmp_path):
+    member = tmp_path / "notes.txt"
+    member.write_text("Jan Novak lives in Prague.\n")
+    archive_path = str(tmp_path / "documents.tar.gz")
+    with tarfile.open(archive_path, "w:gz") as archive:
+        archive.add(member, arcname="notes.txt")
+
+    with pytest.raises(NotStreamableError):
+        list(walk_archive(archive_path))
+
+
+def test_iter_file_paths_skips_nested_extractions(tmp_path):
+    extract_dir = tmp_path / EXTRACT_DIR_NAME
+    extracted = extract_dir / "outer.zip.extracted"
+    (extracted / "inner.zip.extracted").mkdir(parents=True)
+    (extracted / "unfinished.zip.extracted.partial").mkdir()
+    (extracted / "inner.zip").write_bytes(b"")
+    (extracted / "inner.zip.extracted" / "notes.txt").write_text("nested")
+    (extracted / "unfinished.zip.extracted.partial" / "notes.txt").write_text("partial")
+
+    assert list(iter_file_paths(str(extracted), str(extract_dir))) == [str(extracted / "inner.zip")]
+
+
+def make_nested_zip(tmp_path, compression: int) -> str:
+    inner_path = tmp_path / "inner.zip"
+    with zipfile.ZipFile(inner_path, "w") as inner:
+        inner.writestr("notes.txt", "Jan Novak lives in Prague.\n" * 20)
+    archive_path = str(tmp_path / "outer.zip")
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.write(inner_path, arcname="inner.zip", compress_type=compression)
+    return archive_path
+
+
+def test_walk_archive_streams_stored_nested_zip(tmp_path):
+    archive_path = make_nested_zip(tmp_path, zipfile.ZIP_STORED)
+
+    files = list(walk_archive(archive_path))
+
+    assert [file.path for file in files] == [member_path(member_path(archive_path, "inner.zip"), "notes.txt")]
+
+
+def test_walk_archive_leaves_compressed_nested_zip_to_extraction(tmp_path):
+    archive_path = make_nested_zip(tmp_path, zipfile.ZIP_DEFLATED)
+
+    with pytest.raises(NotStreamableError):
+        list(walk_archive(archive_path))
@@ -1,4 +1,5 @@
 from .concurrency import *
 from .logger import setup_logger
+from .metrics import metrics, start_metrics_server
 from .network import *
 from .text import *
@@ -1,24 +1,237 @@
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from functools import partial
+from typing import Optional, Type
 
+from config import config
+from .metrics import metrics
 
-async def run_sync_fn_async_io(function, *args, **kwargs):
+
+class IOPool:
+    """
+    Bounded thread pool for blocking io of one kind, so a slow backend can't exhaust threads needed elsewhere
+    """
+
+    def __init__(self, name: str, n_workers: int):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix=f"nervana-{name}")
+        self.waiting = 0
+        self.running = 0
+        self.lock = threading.Lock()
+        metrics.gauge("io_pool_queue_length", lambda: self.waiting, pool=name)
+        metrics.gauge("io_pool_running", lambda: self.running, pool=name)
+
+    def _run(self, function):
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            return function()
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def submit(self, function) -> Future:
+        with self.lock:
+            self.waiting += 1
+        return self.executor.submit(self._run, function)
+
+    async def run(self, function):
+        return await asyncio.wrap_future(self.submit(function))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+_io_pools: dict[str, IOPool] = {}
+
+
+def get_io_pool(name: str) -> IOPool:
+    """
+    Named thread pool with the number of threads configured in IO_POOL_WORKERS
+    """
+    if name not in _io_pools:
+        _io_pools[name] = IOPool(name, config.IO_POOL_WORKERS[name])
+    return _io_pools[name]
+
+
+def shutdown_io_pools():
+    for pool in _io_pools.values():
+        pool.shutdown()
+    _io_pools.clear()
+
+
+async def run_sync_fn_async_io(function, *args, io_pool: str = "default", **kwargs):
     """
     Run a synchronous io-bound function in a separate thread to make it non-blocking
+    :param io_pool: name of the thread pool to use
     """
     partial_fn = partial(function, *args, **kwargs)
-    result = await asyncio.to_thread(partial_fn)
+    result = await get_io_pool(io_pool).run(partial_fn)
     return result
 
 
+# process pool shared by the whole run, created by start_process_pool
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def _worker_pid() -> int:
+    # keeps the worker busy, so the next tasks go to the other workers
+    time.sleep(0.1)
+    return os.getpid()
+
+
+def start_process_pool(n_workers: int | None = None, initializer=None) -> ProcessPoolExecutor:
+    """
+    Create the long-lived process pool used by run_sync_fn_async_cpu
+    :param n_workers: number of processes, number of CPUs by default
+    :param initializer: function called once in every worker process, e.g. to load models,
+        returns once all processes have finished it
+    """
+    global _process_pool
+    shutdown_process_pool()
+    _process_pool = ProcessPoolExecutor(max_workers=n_workers, initializer=initializer)
+    if initializer is not None:
+        # processes are started on the first task, a worker takes tasks only after its initializer finished
+        n_workers = n_workers or os.cpu_count()
+        started = set()
+        while len(started) < n_workers:
+            futures = [_process_pool.submit(_worker_pid) for _ in range(n_workers)]
+            started.update(future.result() for future in futures)
+    return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    if _process_pool is None:
+        # pool without preloaded models when start_process_pool wasn't called
+        return start_process_pool(config.PROCESS_POOL_WORKERS)
+    return _process_pool
+
+
+def _run_with_metrics(function):
+    # forked process inherits metrics of the parent, only the new ones are sent back
+    metrics.reset()
+    result = function()
+    return result, metrics.snapshot()
+
+
 async def run_sync_fn_async_cpu(function, *args, **kwargs):
     """
     Run a synchronous CPU-heavy function in a separate process to make it non-blocking
     """
     partial_fn = partial(function, *args, **kwargs)
-    # run in process pool executor
+    # run in the shared process pool
     loop = asyncio.get_running_loop()
-    executor = ProcessPoolExecutor()
-    result = await loop.run_in_executor(executor, partial_fn)
+    result, worker_metrics = await loop.run_in_executor(get_process_pool(), partial(_run_with_metrics, partial_fn))
+    metrics.merge(worker_metrics)
     return result
+
+
+class LimiterSlot:
+    """
+    Request holding a slot of AdaptiveLimiter, the caller reports responses of an overloaded backend
+    """
+
+    def __init__(self):
+        self.overloaded = False
+
+    def check_status(self, status_code: int):
+        # too many requests or an error of the backend itself, other errors are caused by the request
+        if status_code == 429 or status_code >= 500:
+            self.overloaded = True
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent requests to a backend.
+    The limit is adjusted by AIMD, it grows additively while requests succeed within the target latency
+    and is cut multiplicatively when the backend is overloaded: on timeouts, transport errors, 429 or 5xx responses
+    and slow responses. Configured maximum is the ceiling.
+    """
+
+    def __init__(self, name: str, max_limit: int, target_latency: float, min_limit: int = 1,
+                 decrease_factor: float = 0.5):
+        """
+        :param target_latency: in seconds per MB of the payload, so large files aren't considered slow
+        """
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        # start in the middle and probe upwards
+        self.limit = float(max(max_limit // 2, min_limit))
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._changed = asyncio.Condition()
+        metrics.gauge("backend_concurrency_limit", lambda: int(self.limit), backend=name)
+        metrics.gauge("backend_in_flight_requests", lambda: self.in_flight, backend=name)
+
+    def _increase(self):
+        # by one after a whole window of successful requests
+        self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def _decrease(self):
+        now = time.monotonic()
+        # requests sent before the last decrease would cause another one
+        if now - self.last_decrease < self.target_latency:
+            return
+        self.last_decrease = now
+        self.limit = max(self.limit * self.decrease_factor, self.min_limit)
+        metrics.inc("backend_limit_decreases_total", backend=self.name)
+
+    @asynccontextmanager
+    async def slot(self, size: int = 0, overload_exceptions: list[Type[Exception]] = ()):
+        """
+        :param size: size of the payload in bytes
+        :param overload_exceptions: exceptions of an overloaded backend like timeouts or transport errors,
+        other exceptions don't change the limit
+        """
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+        request = LimiterSlot()
+        start = time.perf_counter()
+        try:
+            yield request
+        except Exception as e:
+            if request.overloaded or isinstance(e, tuple(overload_exceptions)):
+                self._decrease()
+            raise
+        else:
+            latency = (time.perf_counter() - start) / max(size / 2 ** 20, 1)
+            if request.overloaded or latency > self.target_latency:
+                self._decrease()
+            else:
+                self._increase()
+        finally:
+            async with self._changed:
+                self.in_flight -= 1
+                self._changed.notify_all()
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(backend: str, instance: Optional[str] = None) -> AdaptiveLimiter:
+    """
+    Shared limiter of concurrent requests to the backend configured in BACKEND_CONCURRENCY
+    :param instance: server of a backend running on multiple servers, each of them gets its own limiter
+    """
+    name = f"{backend}@{instance}" if instance else backend
+    if name not in _limiters:
+        limits = config.BACKEND_CONCURRENCY[backend]
+        _limiters[name] = AdaptiveLimiter(name, limits["max_requests"], limits["target_latency"])
+    return _limiters[name]
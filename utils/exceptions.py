@@ -1,2 +1,13 @@
 class TikaError(Exception):
     pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class ServerError(Exception):
+    """
+    Backend responded with a 5xx status code, it's counted as a failure of the backend like a connection error
+    """
+    pass
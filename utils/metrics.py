@@ -0,0 +1,196 @@
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _make_labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _summary_key(labels: Labels) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels) or "all"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts: list[int], total: float):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+        self.count += sum(counts)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the quantile as the upper bound of the bucket containing it
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+
+class Metrics:
+    """
+    Registry of counters, gauges and histograms exported in Prometheus text format
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+        self.gauges: dict[str, dict[Labels, Callable[[], float]]] = {}
+
+    def reset(self):
+        self.__init__()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _make_labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = _make_labels(labels)
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+    def gauge(self, name: str, callback: Callable[[], float], **labels):
+        """
+        Register a gauge whose value is read by calling the callback when metrics are exported
+        """
+        self.gauges.setdefault(name, {})[_make_labels(labels)] = callback
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """
+        Picklable state of counters and histograms, used to transfer metrics from worker processes
+        """
+        return {
+            "counters": self.counters,
+            "histograms": {
+                name: {labels: (histogram.counts, histogram.sum) for labels, histogram in series.items()}
+                for name, series in self.histograms.items()
+            },
+        }
+
+    def merge(self, snapshot: dict):
+        for name, series in snapshot["counters"].items():
+            for labels, value in series.items():
+                self.inc(name, value, **dict(labels))
+        for name, series in snapshot["histograms"].items():
+            histograms = self.histograms.setdefault(name, {})
+            for labels, (counts, total) in series.items():
+                histograms.setdefault(labels, Histogram()).merge(counts, total)
+
+    def prometheus_text(self) -> str:
+        lines = []
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, callback in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {callback()}")
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else bound
+                    bucket_labels = _format_labels(labels, f'le="{le}"')
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        duration = time.time() - self.start_time
+        files_done = self.counters.get("files_processed_total", {}).get(_make_labels({"status": "done"}), 0)
+        summary = {
+            "duration_seconds": duration,
+            "files_per_second": files_done / duration if duration else 0,
+            "counters": {},
+            "gauges": {},
+            "histograms": {},
+        }
+        for name, series in self.counters.items():
+            summary["counters"][name] = {_summary_key(labels): value for labels, value in series.items()}
+        for name, series in self.gauges.items():
+            summary["gauges"][name] = {_summary_key(labels): callback() for labels, callback in series.items()}
+        for name, series in self.histograms.items():
+            summary["histograms"][name] = {
+                _summary_key(labels): {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else 0,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+                for labels, histogram in series.items()
+            }
+        return summary
+
+
+# metrics of this process, worker processes send theirs back to the main process
+metrics = Metrics()
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    """
+    Serve metrics in Prometheus text format on http://localhost:<port>/metrics
+    """
+
+    async def handle_metrics(_: web.Request) -> web.Response:
+        return web.Response(text=metrics.prometheus_text(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", port)
+    try:
+        await site.start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    return runner
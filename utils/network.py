@@ -1,21 +1,119 @@
 import asyncio
 import inspect
-from typing import Type
+import random
+import time
+from typing import Optional, Type
 
+from config import config
 from utils import setup_logger
+from .exceptions import CircuitOpenError
+from .metrics import metrics
 
 logger = setup_logger(__name__)
 
 
+class CircuitBreaker:
+    """
+    Stops calls to a backend after consecutive failures, so workers don't wait for a backend which is down.
+    After the reset timeout trial calls are let through and the first result closes or opens the circuit again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        metrics.gauge("circuit_breaker_open", lambda: int(self.state != self.CLOSED), backend=name)
+
+    @property
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0)
+
+    def before_call(self):
+        if self.state == self.OPEN:
+            if self.retry_after > 0:
+                raise CircuitOpenError(f"{self.name} is unavailable, retry in {self.retry_after:.0f} seconds")
+            self.state = self.HALF_OPEN
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} is available again")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"{self.name} is failing, stopping calls for {self.reset_timeout} seconds")
+                metrics.inc("circuit_breaker_trips_total", backend=self.name)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of all calls, so retries can't multiply the load of a failing backend
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float = 100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.last_refill) * self.min_per_second, self.max_tokens)
+        self.last_refill = now
+
+    def record_call(self):
+        self._refill()
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def try_retry(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            metrics.inc("retry_budget_exhausted_total")
+            return False
+        self.tokens -= 1
+        return True
+
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+# retries of all backends share one budget
+retry_budget = RetryBudget(config.RETRY_BUDGET_RATIO, config.RETRY_BUDGET_MIN_PER_SECOND)
+
+
+def get_circuit_breaker(backend: str) -> CircuitBreaker:
+    if backend not in _circuit_breakers:
+        _circuit_breakers[backend] = CircuitBreaker(
+            backend, config.CIRCUIT_BREAKER_FAILURES, config.CIRCUIT_BREAKER_RESET_SECONDS
+        )
+    return _circuit_breakers[backend]
+
+
 async def exponential_backoff_async(
         func: callable,
         retry_exceptions: list[Type[Exception]],
         max_retries: int = 3,
         backoff_factor: float = 2,
         delay: float = 4,
+        breaker: Optional[CircuitBreaker] = None,
         *args,
         **kwargs,
 ):
+    """
+    Call the coroutine function and retry it with jittered exponential backoff on given exceptions
+    :param breaker: circuit breaker of the called backend, raises CircuitOpenError instead of calling it when open
+    """
     if not inspect.iscoroutinefunction(func):
         raise ValueError("Function must be a coroutine")
 
@@ -23,13 +121,23 @@ async def exponential_backoff_async(
     retries = 0
 
     while retries < max_retries:
+        if breaker:
+            breaker.before_call()
+        retry_budget.record_call()
         try:
-            return await func(*args, **kwargs)
+            result = await func(*args, **kwargs)
         except allowed_exceptions as e:
+            if breaker:
+                breaker.record_failure()
             retries += 1
-            if retries >= max_retries:
+            if retries >= max_retries or not retry_budget.try_retry():
                 raise e
 
             logger.warning(f"Retrying ({retries}/{max_retries}) due to error: {e}")
-            await asyncio.sleep(delay)
+            # jitter prevents workers from retrying in lock-step
+            await asyncio.sleep(random.uniform(0, delay))
             delay *= backoff_factor
+        else:
+            if breaker:
+                breaker.record_success()
+            return result